@@ -0,0 +1,301 @@
+# airfoil.py
+#
+# Aerodynamic coefficients as lookup tables. An airfoil holds the
+# coefficient of lift and drag against angle of attack (degrees), and the
+# lift multiplier against airspeed (knots), each sampled on an evenly
+# spaced grid and read back by linear interpolation. A lookup takes a
+# number or a numpy array, so airplane.py and fleet.py share the same
+# tables.
+#
+# The default airfoil is built from the formulas below. Others are read
+# from CSV files in airfoils/, so a new airfoil needs no code:
+#
+#   airfoils/<name>.csv        columns aoa, CoL, CoD (one row per AoA)
+#   airfoils/<name>-lift.csv   optional: CoL against AoA *and* airspeed.
+#                              The first row is the airspeeds (kts) after
+#                              an empty cell, every other row is an AoA
+#                              followed by its CoL at each airspeed.
+#
+# Rows don't have to be evenly spaced; they are resampled onto the table
+# grid when loaded. Running this module prints the default airfoil in the
+# first format:
+#
+# > python3 airfoil.py > airfoils/pyflight.csv
+#
+# It prints a row every degree, and every table row (AOA_STEP apart)
+# around the stall, where the curves bend or jump too sharply for a line
+# from one degree to the next. Loaded back, it is within CSV_TOLERANCE of
+# the default airfoil.
+#
+# (CoLCurve.fig is a MATLAB figure of the lift curve, not a data file;
+# it isn't read here.)
+
+import sys
+from os.path import join, dirname, exists
+from numpy import arange, array, asarray, clip, exp, where, abs, \
+     interp, loadtxt, savetxt, column_stack, float64, intp, zeros, isin
+
+AOA_RANGE = (-180.0, 180.0) # degrees, the whole circle
+AOA_STEP = 0.05
+SPEED_RANGE = (0.0, 2000.0) # knots
+SPEED_STEP = 1.0
+CSV_TOLERANCE = 0.001 # how far main's CSV may be off the default airfoil
+
+AIRFOILS = join(dirname(__file__), 'airfoils') # where the CSV files are
+
+
+# The formulas the default airfoil is made from. They work on numbers or
+# numpy arrays.
+
+def CoL(aoa):
+    """ Coefficient of lift at angle of attack aoa (degrees) """
+
+    # CoL is different for every airfoil. I decided to create a plausible
+    # airfoil by combining two logistic functions. The wing should
+    # generate good lift between around 10 and 22 degrees, after 22 deg,
+    # there is a rapid dropoff in lift. The CoL never goes below
+    # 0.3, so the plane can always be controlled somewhat.
+    rising = 1.0 / (1.0 + exp(-0.20 * (aoa + 4.0)))
+    falling = 1.0 - (1.0 / (1.0 + exp(-0.45 * (aoa - 35))))
+    c = where(aoa <= 22.87, rising, falling)
+    # Outside this, the wing is completely stalled. You still get a
+    # little lift.
+    return where((aoa <= -8.3) | (aoa >= 36.88), 0.3, c)
+
+
+def CoD(aoa):
+    """ Coefficient of drag at angle of attack aoa (degrees) """
+    # CoD is related to AoA quadratically, up to the maximum
+    return where(abs(aoa) > 31.5, 1.0, 0.0005 * aoa**2)
+
+
+def airspeedMultiplier(kts):
+    """ Lift multiplier at airspeed kts. Airspeed should increase lift
+    quadratically, but I'm modeling it as a sigmoidal relationship - so
+    the plane shouldn't get much extra lift about 350kts. """
+    return 2.25 / (1 + exp(-0.024 * (kts - 212)))
+
+
+class table:
+    # A function of one variable, sampled every step from start. Outside
+    # the sampled range it is held at the first / last value.
+
+    def __init__(s, start, step, values):
+        """ Make a table of values[i] at start + i*step """
+        s.start = float(start)
+        s.step = float(step)
+        s.inverse = 1.0 / s.step
+        s.values = asarray(values, dtype=float64)
+        s.list = s.values.tolist() # for the scalar lookups
+        s.end = len(s.list) - 1 # last index
+
+    @classmethod
+    def sample(cls, f, lo, hi, step):
+        """ Make a table of function f from lo to hi """
+        return cls(lo, step, f(arange(lo, hi + step/2, step)))
+
+    @classmethod
+    def resample(cls, x, y, lo, hi, step):
+        """ Make a table from points (x[i], y[i]), x increasing, any
+        spacing """
+        return cls(lo, step, interp(arange(lo, hi + step/2, step), x, y))
+
+    def grid(s):
+        """ The x of each value """
+        return s.start + arange(len(s.list)) * s.step
+
+    def __call__(s, x):
+        """ The value at x, a number or an array """
+        if isinstance(x, (float, int)):
+            f = (x - s.start) * s.inverse
+            if f <= 0.0:
+                return s.list[0]
+            if f >= s.end:
+                return s.list[-1]
+            i = int(f)
+            y = s.list
+            return y[i] + (f - i) * (y[i+1] - y[i])
+
+        f = clip((asarray(x, dtype=float64) - s.start) * s.inverse, 0, s.end)
+        i = f.astype(intp)
+        i[i == s.end] = s.end - 1
+        f -= i
+        y = s.values
+        return y[i] + f * (y[i+1] - y[i])
+
+
+class table2:
+    # A function of two variables, sampled on a grid: rows every xstep
+    # from xstart, columns every ystep from ystart. Bilinear
+    # interpolation, held at the edges.
+
+    def __init__(s, xstart, xstep, ystart, ystep, values):
+        """ Make a table of values[i, j] at (xstart + i*xstep,
+        ystart + j*ystep) """
+        s.x = table(xstart, xstep, values[:, 0])
+        s.y = table(ystart, ystep, values[0])
+        s.values = asarray(values, dtype=float64)
+        s.list = s.values.tolist()
+
+    @classmethod
+    def resample(cls, x, y, z, xlo, xhi, xstep, ylo, yhi, ystep):
+        """ Make a table from values z[i, j] at (x[i], y[j]), x and y
+        increasing, any spacing """
+        xs = arange(xlo, xhi + xstep/2, xstep)
+        ys = arange(ylo, yhi + ystep/2, ystep)
+        rows = array([interp(ys, y, row) for row in z]) # along y first
+        values = array([interp(xs, x, col) for col in rows.T]).T
+        return cls(xlo, xstep, ylo, ystep, values)
+
+    def index(s, t, v):
+        """ Integer and fraction grid position of v along axis table t """
+        if isinstance(v, (float, int)):
+            f = (v - t.start) * t.inverse
+            f = 0.0 if f < 0.0 else t.end if f > t.end else f
+            i = int(f)
+            if i == t.end:
+                i = t.end - 1 if t.end > 0 else 0
+            return i, f - i
+        f = clip((asarray(v, dtype=float64) - t.start) * t.inverse, 0, t.end)
+        i = f.astype(intp)
+        i[i == t.end] = max(t.end - 1, 0)
+        return i, f - i
+
+    def __call__(s, x, y):
+        """ The value at (x, y), numbers or arrays """
+        i, fx = s.index(s.x, x)
+        j, fy = s.index(s.y, y)
+        if isinstance(i, int) and isinstance(j, int):
+            z = s.list
+            top = z[i][j] + fy * (z[i][j+1] - z[i][j])
+            bottom = z[i+1][j] + fy * (z[i+1][j+1] - z[i+1][j])
+            return top + fx * (bottom - top)
+        z = s.values
+        top = z[i, j] + fy * (z[i, j+1] - z[i, j])
+        bottom = z[i+1, j] + fy * (z[i+1, j+1] - z[i+1, j])
+        return top + fx * (bottom - top)
+
+
+class airfoil:
+    # The coefficients of one airfoil, as tables.
+
+    def __init__(s, lift, drag, speed):
+        """ Make an airfoil from tables: lift, CoL against AoA (a table)
+        or against AoA and airspeed in knots (a table2); drag, CoD against
+        AoA; speed, the lift multiplier against airspeed. """
+        s.lift = lift
+        s.drag = drag
+        s.speed = speed
+
+    @classmethod
+    def fromFormulas(cls):
+        """ The default airfoil, made from CoL, CoD and
+        airspeedMultiplier """
+        return cls(table.sample(CoL, AOA_RANGE[0], AOA_RANGE[1], AOA_STEP),
+                   table.sample(CoD, AOA_RANGE[0], AOA_RANGE[1], AOA_STEP),
+                   table.sample(airspeedMultiplier, SPEED_RANGE[0],
+                                SPEED_RANGE[1], SPEED_STEP))
+
+    @classmethod
+    def load(cls, name, directory=AIRFOILS):
+        """ Read airfoil name from its CSV file(s) in directory (see the
+        top of this file). The airspeed multiplier stays the default
+        one. """
+
+        aoa, cl, cd = loadtxt(join(directory, name + '.csv'), delimiter=',',
+                              skiprows=1, unpack=True)
+        lift = table.resample(aoa, cl, AOA_RANGE[0], AOA_RANGE[1], AOA_STEP)
+        drag = table.resample(aoa, cd, AOA_RANGE[0], AOA_RANGE[1], AOA_STEP)
+
+        path = join(directory, name + '-lift.csv')
+        if exists(path):
+            grid = loadtxt(path, delimiter=',')
+            kts = grid[0, 1:]
+            lift = table2.resample(grid[1:, 0], kts, grid[1:, 1:],
+                                   AOA_RANGE[0], AOA_RANGE[1], AOA_STEP,
+                                   kts[0], kts[-1], SPEED_STEP)
+
+        speed = table.sample(airspeedMultiplier, SPEED_RANGE[0],
+                             SPEED_RANGE[1], SPEED_STEP)
+        return cls(lift, drag, speed)
+
+    def coefficients(s, aoa, kts):
+        """ (CoL, CoD, lift multiplier) at angle of attack aoa (degrees)
+        and airspeed kts, both numbers. Does the three lookups at once,
+        which is quicker than calling CoL, CoD and multiplier. """
+
+        lift = s.lift
+        drag = s.drag
+        if isinstance(lift, table2) or lift.start != drag.start \
+           or lift.step != drag.step or lift.end != drag.end:
+            return s.CoL(aoa, kts), s.CoD(aoa), s.multiplier(kts)
+
+        # CoL and CoD share the AoA grid
+        f = (aoa - lift.start) * lift.inverse
+        f = 0.0 if f < 0.0 else lift.end if f > lift.end else f
+        i = int(f)
+        if i == lift.end:
+            i -= 1
+        f -= i
+        y = lift.list
+        cl = y[i] + f * (y[i+1] - y[i])
+        y = drag.list
+        cd = y[i] + f * (y[i+1] - y[i])
+
+        speed = s.speed
+        f = (kts - speed.start) * speed.inverse
+        f = 0.0 if f < 0.0 else speed.end if f > speed.end else f
+        i = int(f)
+        if i == speed.end:
+            i -= 1
+        f -= i
+        y = speed.list
+        return cl, cd, y[i] + f * (y[i+1] - y[i])
+
+    def CoL(s, aoa, kts=None):
+        """ Coefficient of lift at angle of attack aoa (degrees) and
+        airspeed kts, numbers or arrays. kts is only needed if the lift
+        table depends on airspeed. """
+        if isinstance(s.lift, table2):
+            return s.lift(aoa, kts)
+        return s.lift(aoa)
+
+    def CoD(s, aoa):
+        """ Coefficient of drag at angle of attack aoa (degrees) """
+        return s.drag(aoa)
+
+    def multiplier(s, kts):
+        """ Lift multiplier at airspeed kts """
+        return s.speed(kts)
+
+
+loaded = {} # name -> airfoil, so every airplane shares the tables
+
+def get(name=None):
+    """ The airfoil called name (see airfoil.load), or the default one
+    for None. Each is only built once. """
+    if name not in loaded:
+        loaded[name] = airfoil.fromFormulas() if name is None \
+                       else airfoil.load(name)
+    return loaded[name]
+
+
+def main(argv):
+    """ Print the default airfoil as CSV """
+    foil = get(None)
+    aoa = foil.lift.grid()
+    cl = foil.CoL(aoa)
+    cd = foil.CoD(aoa)
+    degree = arange(len(aoa)) // int(round(1 / AOA_STEP)) # of each row
+    keep = zeros(len(aoa), dtype=bool)
+    keep[::int(round(1 / AOA_STEP))] = True # every degree
+    for y in (cl, cd):
+        # Every row of each degree a line across it is too far off in
+        off = abs(interp(aoa, aoa[keep], y[keep]) - y) > CSV_TOLERANCE
+        keep |= isin(degree, degree[off])
+    print("aoa,CoL,CoD")
+    savetxt(sys.stdout, column_stack((aoa, cl, cd))[keep], fmt='%.6g',
+            delimiter=',')
+
+
+if __name__ == '__main__': main(sys.argv)
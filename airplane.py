@@ -18,9 +18,58 @@ from ctypes import *
 from units import *
 from part import *
 from rigidbody import *
-from OpenGL.GL import *
-from OpenGL.GLUT import *
-from OpenGL.GLUT.freeglut import *
+import airfoil
+import atmosphere
+from wing import wing
+from tracing import traced
+
+
+class aeroState:
+    # The aerodynamic quantities of a rigid body at one state: airspeed,
+    # AoA, coefficients and the resulting lift and drag. The airplane's
+    # force functions and the HUD all read them from here (see
+    # airplane.aero), so they're only worked out once per state.
+
+    def __init__(s):
+        """ Make an empty aeroState; call update before using it. """
+        s.body = None # the rigid body it was computed for...
+        s.version = -1 # ...and the body's state version at the time
+        s.airspeed = 0.0 # world units per second
+        s.AoA = 0.0 # degrees
+        s.CoL = 0.0
+        s.CoD = 0.0
+        s.multiplier = 0.0 # airspeed multiplier for lift
+        s.density = 1.0 # air density, relative to 12000 ft
+        s.warning = False # close to stalling
+        s.lift = vector(0.0, 0.0, 0.0)
+        s.drag = vector(0.0, 0.0, 0.0)
+
+    def update(s, plane, obj):
+        """ Recompute everything for airplane plane's rigid body obj """
+
+        s.body = obj
+        s.version = obj.version
+        v = obj.V
+        s.airspeed = v.norm()
+        s.AoA = plane.AoAFor(obj)
+        s.warning = s.AoA > 30
+        speed = WUps2kts(s.airspeed) # knots per hour
+        s.CoL, s.CoD, s.multiplier = plane.airfoil.coefficients(s.AoA, speed)
+        s.density = plane.atmosphere.ratio(WU2ft(obj.P.y))
+
+        # Lift just multiplies CoL by airflow and by another constant.
+        # Use the constant to adjust how much lift the plane gets.
+        # A heavier plane will need more lift, etc.
+        z = 70 # Adjust this coefficient to get the
+        # right amount of lift (represents wing area and air density at
+        # 12000 ft; the actual density scales it)
+        s.lift.set_to(obj.lift).iscale(s.multiplier*s.CoL*z*s.density)
+
+        # Drag always goes in the opposite direction of velocity.
+        # It's related to the CoD and the velocity squared.
+        magnitude = speed * 6076/3600 # converts to ft/s
+        p = 0.001 * s.density # Air density (lbm/ft^3)
+        s.drag.set_to(v).iscale(-1/2 * p * s.CoD * magnitude**2)
 
 
 class airplane:
@@ -38,9 +87,14 @@ class airplane:
         
         s.Pilot = point(0.0, s.altitude, 0.0)
         s.Nose = s.Pilot + vector(0.0, 0.0, 1.0)
-        s.Up = s.Pilot + vector(0.0, 1.0, 0.0)
+        s.Up = vector(0.0, 1.0, 0.0)
         s.velocity = vector(0.0, 0.0, 1.0).scale(s.airspeed)
 
+        # The viewpoint before the last fly(), for render interpolation
+        s.prevPilot = point(0.0, 0.0, 0.0).set_to(s.Pilot)
+        s.prevNose = point(0.0, 0.0, 0.0).set_to(s.Nose)
+        s.prevUp = vector(0.0, 0.0, 0.0).set_to(s.Up)
+
 
         ### OK. Init the rigid body.
         # The rigid body is the plane itself - it handles forces
@@ -51,12 +105,32 @@ class airplane:
         s.rigid.addForce(s.thrust)
         s.rigid.addForce(s.drag)
         s.rigid.addForce(s.gravity(s.rigid))
-        s.rigid.addPointForce(s.leftWing, 'left')
-        s.rigid.addPointForce(s.rightWing, 'right')
+        s.wingModel = WING_MODEL
+        s.wingPanels = WING_PANELS if WING_MODEL == 'panels' else 0
+        if WING_MODEL == 'panels':
+            s.wings = wing(s, WING_PANELS) # blade elements, see wing.py
+            s.rigid.addWrench(s.wings.wrench)
+        else:
+            s.rigid.addPointForce(s.leftWing, 'left')
+            s.rigid.addPointForce(s.rightWing, 'right')
         s.rigid.addPointForce(s.elevator, 'tail')
         s.rigid.addPointForce(s.rudder, 'tail')
         s.rigid.addPointForce(s.stabilizer, 'tail')
         s.warning = False # whether or not to flash the warning lamp
+        s.aeroCache = aeroState() # see aero()
+        s.airfoilName = AIRFOIL
+        # The vectors the force functions below return, reused every
+        # time so computing the forces doesn't create any
+        s.thrustForce = vector(0.0, 0.0, 0.0)
+        s.rightForce = vector(0.0, 0.0, 0.0)
+        s.leftForce = vector(0.0, 0.0, 0.0)
+        s.elevatorForce = vector(0.0, 0.0, 0.0)
+        s.rudderForce = vector(0.0, 0.0, 0.0)
+        s.stabilizerForce = vector(0.0, 0.0, 0.0)
+        s.airfoil = airfoil.get(AIRFOIL) # lift and drag coefficient tables
+        s.atmosphere = atmosphere.standard # air density by altitude
+        s.time = 0.0 # sim seconds flown
+        s.recorder = None # flight data recorder, see recorder.py
         
         # Control parameters
         s.x = 0.0 # The mouse/joystick x coord (-0.5 to 0.5)
@@ -72,39 +146,75 @@ class airplane:
     def inputRudder(s, rudder_input):
         """ Sets the current rudder input """
         s.r = rudder_input
-        
-    def fly(s):
-        """ Update the airplane's position, direction """
+
+    def settings(s):
+        """ How the airplane's physics is set up - its integrator, wing
+        model and airfoil - as a dict. Two airplanes with the same
+        settings fly the same inputs the same way. """
+        return {'integrator': s.rigid.integratorName,
+                'wing model': s.wingModel, 'wing panels': s.wingPanels,
+                'airfoil': s.airfoilName}
+
+    def snapshot(s):
+        """ The whole flight state - the rigid body's (see
+        rigidBody.snapshot) and the airplane's own - as one array, for
+        restore. The control inputs aren't part of it; they're set before
+        every step anyway. """
+        return concatenate((s.rigid.snapshot(),
+                            [s.time, 1.0 if s.warning else 0.0, s.airspeed,
+                             s.AngleOfAttack, s.altitude],
+                            s.Nose.components(), s.Up.components(),
+                            s.prevPilot.components(),
+                            s.prevNose.components(),
+                            s.prevUp.components()))
+
+    def restore(s, a):
+        """ Go back to snapshot a; flying on from there repeats the
+        original flight exactly, given the same inputs """
+        s.rigid.restore(a[:SNAPSHOT_SIZE])
+        a = a[SNAPSHOT_SIZE:].tolist()
+        s.time = a[0]
+        s.warning = a[1] != 0.0
+        s.airspeed, s.AngleOfAttack, s.altitude = a[2:5]
+        s.Pilot = s.rigid.P
+        s.Nose.set(*a[5:8])
+        s.Up.set(*a[8:11])
+        s.prevPilot.set(*a[11:14])
+        s.prevNose.set(*a[14:17])
+        s.prevUp.set(*a[17:20])
+
+    @traced('airplane.fly', 'physics')
+    def fly(s, dt=TIMESTEP):
+        """ Update the airplane's position, direction, dt seconds on """
         # Tell the rigid body to go for it
         s.warning = False # reset the warning
-        rigidBody.updateAll()
+        s.prevPilot.set_to(s.Pilot)
+        s.prevNose.set_to(s.Nose)
+        s.prevUp.set_to(s.Up)
+        s.rigid.step(dt)
 
         s.airspeed = s.rigid.V.norm()
-        s.Nose = s.rigid.P + s.rigid.n.unit() 
         s.Pilot = s.rigid.P
-        s.Up = s.rigid.lift.unit()
+        s.Nose.set_to(s.Pilot).iadd(s.rigid.n) # n is always unit length
+        s.Up.set_to(s.rigid.lift)
         s.AngleOfAttack = s.AoA(s.rigid)
         s.altitude = s.rigid.P.y
+        s.time += dt
+        if s.recorder is not None:
+            s.recorder.record(s)
 
 
     def thrust(s, obj):
         """ Compute the current thrust force vector in world units
         per frame, on the rigid body obj. """
         #return vector(0.0, 0.0, 0.0)
-        return obj.n.scale(ft2WU(2000))
+        return s.thrustForce.set_to(obj.n).iscale(ft2WU(2000))
 
 
     def drag(s, obj):
-        """ Compute current drag vector, return it """
-        # Drag always goes in the opposite direction of velocity.
-        # It's related to the CoD and the velocity squared.
-
-        v = obj.V
-        dragCoefficient = s.CoD(obj)
-        magnitude = WUps2kts(v.norm()) # knots per hour
-        magnitude = magnitude * 6076/3600 # converts to ft/s
-        p = 0.001 # Air density (lbm/ft^3)
-        return(v.scale(-1/2 * p * dragCoefficient * magnitude**2))
+        """ Compute current drag vector, return it. The vector is shared
+        (see aero), so don't change it. """
+        return s.aero(obj).drag
         
     
         
@@ -116,85 +226,68 @@ class airplane:
         
         return obj.V.projOnto(obj.n)
 
+
+    def aero(s, obj):
+        """ Returns the aeroState for the rigid body obj as it is now.
+        It's only recomputed when obj's state has changed since the last
+        call, so all the forces (and the HUD) share one computation per
+        integration stage. """
+
+        a = s.aeroCache
+        if a.body is not obj or a.version != obj.version:
+            a.update(s, obj)
+        return a
+
         
     def AoA(s, obj):
         """ Computes the current angle of attack, in degrees. AoA is the
         angle between where the plane is pointed, and where it's actually
         going. """
-
-        # Check if AoA should be negative. AoA is negative
-        # when the angle between the flight vector and the lift vector
-        # is less than 90 deg.
-        
-        if (obj.V.angleBetween(obj.lift) < pi/2):
-            return -((obj.n.angleBetween(obj.V)) * (180/pi))
-
-        return (obj.n.angleBetween(obj.V)) * (180/pi)
+        return s.aero(obj).AoA
 
         
     def CoL(s, obj):
         """ Computes the coefficient of lift for this airfoil. CoL
         is a function of angle of attack. """
-        
-        # CoL is different for every airfoil. I decided to create a plausible
-        # airfoil by combining two logistic functions. The wing should
-        # generate good lift between around 10 and 22 degrees, after 22 deg,
-        # there is a rapid dropoff in lift. The CoL never goes below
-        # 0.3, so the plane can always be controlled somewhat.
-        
-        aoa = s.AoA(obj)
-        if aoa > 30:
+        a = s.aero(obj)
+        if a.warning:
             #warning! you're about to stall!
             s.warning = True
-        
-        if aoa <= -8.3 or aoa >= 36.88:
-            return 0.3 # the wing is completely stalled. You still get a little
-            # lift.
-
-        if aoa <= 22.87:
-            # We are in the ascending part of curve:
-            return 1.0 / (1.0 + exp(-0.20 * (aoa + 4.0)))
-
-        # otherwise, we are in the descending part of the curve (the
-        # wing is starting to stall)
-        return 1.0 - (1.0 / (1.0 + exp(-0.45 * (aoa - 35))))
+        return a.CoL
 
 
     def CoD(s, obj):
         """ Computes the coefficient of drag, a function of AoA. """
-        aoa = s.AoA(obj)
-        if aoa > 31.5 or aoa < -31.5:
-            return 1.0 # maximum CoD reached
-        # CoD is related to AoA quadratically
-        return 0.0005 * aoa**2
+        return s.aero(obj).CoD
 
 
 
     def lift(s, obj):
-        """ Compute the current lift magnitude, return it.
-        Lift is a function of airflow and coefficient of lift """
-
-        # Lift just multiplies CoL by airflow and by another constant.
-        # Use the constant to adjust how much lift the plane gets.
-        # A heavier plane will need more lift, etc.
-        
-        liftCoefficient = s.CoL(obj) 
-        speedCoefficient = s.airspeedMultiplier(obj)
-        z = 70 # Adjust this coefficient to get the
-        # right amount of lift (represents wing area and air density)
-        
-        return obj.lift.scale(speedCoefficient*liftCoefficient*z)
+        """ Compute the current lift vector, return it. The vector is
+        shared (see aero), so don't change it. """
+        s.CoL(obj) # for the stall warning
+        return s.aero(obj).lift
         
 
 
     def airspeedMultiplier(s, obj):
-        """ Returns the airspeed multiplier. Airspeed should increase
-        lift quadratically, but I'm modeling it as a sigmoidal relationship-
-        so the plane shouldn't get much extra lift about 350kts. """
+        """ Returns the airspeed multiplier. """
+        return s.aero(obj).multiplier
+
 
-        speed = WUps2kts(obj.V.norm())
-        return 2.25 / (1 + exp(-0.024 * (speed - 212)))
+    def AoAFor(s, obj):
+        """ Works out the angle of attack of rigid body obj, in degrees """
+
+        # Check if AoA should be negative. AoA is negative
+        # when the angle between the flight vector and the lift vector
+        # is less than 90 deg.
         
+        if (obj.V.angleBetween(obj.lift) < pi/2):
+            return -((obj.n.angleBetween(obj.V)) * (180/pi))
+
+        return (obj.n.angleBetween(obj.V)) * (180/pi)
+
+
     def getP(s):
         """ Returns the position, scaled to world units """
         return point(s.P.x*s, s.P.y*s, s.P.z*s)
@@ -204,8 +297,7 @@ class airplane:
         """ Models the right wing. The right wing has lift; its lift
         is scaled by the control input (allowing the plane to roll) """
 
-        lift = s.lift(obj)/2
-        return lift.scale(s.x+1)
+        return s.rightForce.set_to(s.lift(obj)).iscale((s.x+1)/2)
         #return s.rigid.lift.scale(-s.lift(obj) * (-s.x + 1))
 
 
@@ -214,18 +306,18 @@ class airplane:
         """ Models the left wing. The left wing has lift; its lift
         is scaled by the control input (allowing the plane to roll) """
 
-        lift = s.lift(obj)/2 # Two wings so divide by 2
-        return lift.scale(-s.x + 1)
+        # Two wings so divide by 2
+        return s.leftForce.set_to(s.lift(obj)).iscale((-s.x + 1)/2)
         
 
     def elevator(s, obj):
         """ A very simple elevator. """
-        return s.lift(s.rigid).scale(-s.y/2)
+        return s.elevatorForce.set_to(s.lift(s.rigid)).iscale(-s.y/2)
 
     def rudder(s, obj):
         """ A very simple rudder """
         lift = s.lift(obj)
-        return lift.cross(obj.n).scale(s.r*0.15)
+        return s.rudderForce.set_to(lift).icross(obj.n).iscale(s.r*0.15)
 
     def stabilizer(s, obj):
         """ Airplanes are designed to be stable. This represents a well
@@ -235,17 +327,27 @@ class airplane:
         makes the plane feel more like a real airplane, and makes it
         easier to control. """
         
-        offsetVector = obj.n + obj.V.unit().scale(-1) # Difference between nose
-        # and actual direction
+        offsetVector = s.stabilizerForce.set_to(obj.V).iunit().ineg() \
+                       .iadd(obj.n) # Difference between nose and actual
+        # direction
 
-        return offsetVector.scale(s.CoL(obj)*2)
+        return offsetVector.iscale(s.CoL(obj)*2)
 
         
     def gravity(s, obj):
-        """ Gets the gravity vector """
+        """ Gets the gravity vector (called once, to add it as a constant
+        force) """
         return vector(0.0, -(ft2WU(32.2))*obj.M, 0.0)
 
-    def getViewpoint(s):
+    def getViewpoint(s, alpha=1.0):
         """ Return the current viewing parameters - pilot position,
-        nose position, and up vector """
-        return s.Pilot, s.Nose, s.Up
\ No newline at end of file
+        nose position, and up vector. With alpha < 1, returns the
+        viewpoint that fraction of the way from the one before the last
+        fly() to the current one. """
+        if alpha >= 1.0:
+            return s.Pilot, s.Nose, s.Up
+
+        Pilot = s.prevPilot.combo(alpha, s.Pilot)
+        Nose = s.prevNose.combo(alpha, s.Nose)
+        Up = s.prevUp.scale(1.0 - alpha).iadd_scaled(alpha, s.Up).iunit()
+        return Pilot, Nose, Up
\ No newline at end of file
@@ -0,0 +1,95 @@
+# atmosphere.py
+#
+# The International Standard Atmosphere (ISA): air temperature, density
+# and speed of sound against altitude, up to the top of the lower
+# stratosphere (20 km, ~65,600 ft). The model is worked out once, into
+# airfoil.py style tables every ALTITUDE_STEP feet, so a lookup costs a
+# linear interpolation. Lookups take a number or a numpy array of
+# altitudes in feet.
+#
+# The flight model was tuned at the 12,000 ft start altitude, with the
+# air density folded into its lift and drag constants. So airplane.py and
+# fleet.py scale lift and drag by ratio(): the density relative to the
+# density at REFERENCE_ALTITUDE. The plane flies the same as before at
+# 12,000 ft, gets more lift and drag below it and less above it.
+
+from numpy import arange, asarray, where, exp, sqrt, float64
+
+from airfoil import table
+
+ALTITUDE_RANGE = (-2000.0, 66000.0) # feet, held constant outside this
+ALTITUDE_STEP = 10.0 # feet
+REFERENCE_ALTITUDE = 12000.0 # feet, where ratio() is 1
+
+# ISA constants, SI units
+SEA_LEVEL_TEMPERATURE = 288.15 # K
+SEA_LEVEL_PRESSURE = 101325.0 # Pa
+LAPSE_RATE = 0.0065 # K/m, in the troposphere
+TROPOPAUSE = 11000.0 # m
+GAS_CONSTANT = 287.053 # J/(kg K), for dry air
+GRAVITY_SI = 9.80665 # m/s^2
+GAMMA = 1.4 # ratio of specific heats
+
+METERS_PER_FOOT = 0.3048
+LBM_FT3_PER_KG_M3 = 0.062428
+KTS_PER_MPS = 1.943844
+
+
+def isa(meters):
+    """ ISA temperature (K), pressure (Pa) and density (kg/m^3) at
+    altitude meters, a number or an array """
+
+    h = asarray(meters, dtype=float64)
+    tropopause = SEA_LEVEL_TEMPERATURE - LAPSE_RATE * TROPOPAUSE
+    exponent = GRAVITY_SI / (GAS_CONSTANT * LAPSE_RATE)
+
+    # Troposphere: temperature drops linearly
+    T = SEA_LEVEL_TEMPERATURE - LAPSE_RATE * h
+    p = SEA_LEVEL_PRESSURE * (T / SEA_LEVEL_TEMPERATURE)**exponent
+
+    # Lower stratosphere: constant temperature, pressure drops
+    # exponentially
+    p11 = SEA_LEVEL_PRESSURE * (tropopause / SEA_LEVEL_TEMPERATURE)**exponent
+    above = h > TROPOPAUSE
+    T = where(above, tropopause, T)
+    p = where(above, p11 * exp(-GRAVITY_SI / (GAS_CONSTANT * tropopause)
+                               * (h - TROPOPAUSE)), p)
+    return T, p, p / (GAS_CONSTANT * T)
+
+
+class atmosphere:
+    # The ISA as tables, by altitude in feet.
+
+    def __init__(s, lo=ALTITUDE_RANGE[0], hi=ALTITUDE_RANGE[1],
+                 step=ALTITUDE_STEP, reference=REFERENCE_ALTITUDE):
+        """ Tabulate the atmosphere from lo to hi feet, every step feet.
+        ratio() is relative to the density at reference feet. """
+
+        ft = arange(lo, hi + step/2, step)
+        T, p, rho = isa(ft * METERS_PER_FOOT)
+        T0, p0, rho0 = isa(reference * METERS_PER_FOOT)
+
+        s.temperatures = table(lo, step, T)
+        s.densities = table(lo, step, rho * LBM_FT3_PER_KG_M3)
+        s.ratios = table(lo, step, rho / rho0)
+        s.sounds = table(lo, step, sqrt(GAMMA * GAS_CONSTANT * T)
+                         * KTS_PER_MPS)
+
+    def temperature(s, ft):
+        """ Air temperature (K) at ft feet """
+        return s.temperatures(ft)
+
+    def density(s, ft):
+        """ Air density (lbm/ft^3) at ft feet """
+        return s.densities(ft)
+
+    def ratio(s, ft):
+        """ Air density at ft feet, relative to the reference altitude """
+        return s.ratios(ft)
+
+    def speedOfSound(s, ft):
+        """ Speed of sound (kts) at ft feet """
+        return s.sounds(ft)
+
+
+standard = atmosphere() # the one airplane.py and fleet.py use
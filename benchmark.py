@@ -0,0 +1,392 @@
+# benchmark.py
+#
+# Benchmarks for pyflight. Runs headless (no window is opened), so it can
+# be run on any machine with numpy:
+#
+# > python3 benchmark.py [section ...] [map.raw] [--save results.json]
+#                        [--baseline baseline.json]
+#
+# The sections (all of them by default) are:
+#
+# micro        Microbenchmarks of the hot paths - geometry.vector,
+#              quat.times, rigidBody.updatePositionsEuler, airplane.fly
+#              and landscape.makeQuadsArray - in calls per second, with a
+#              95% confidence interval. The suite runs ROUNDS times, each
+#              in a new Python process, warming every microbenchmark up
+#              before timing it with the garbage collector off. The
+#              intervals come from how much the rounds differ, so they
+#              cover the process to process and minute to minute drift
+#              of a busy machine too. --save writes them to a JSON file;
+#              --baseline compares them against one saved earlier, and
+#              the exit status is 1 if anything got significantly slower.
+# raycast      The hierarchical landscape.raycast against brute-force
+#              landscape.raymarch, for batches of rays and single rays.
+# integrators  The rigidBody integrators: what a step costs against how
+#              far the trajectory drifts from a reference (RK4 with a much
+#              smaller timestep), at a few timesteps.
+# adaptive     The adaptive integrator at a few tolerances.
+#
+# e.g. save a baseline, change something, then check it:
+#
+# > python3 benchmark.py micro --save baseline.json
+# > python3 benchmark.py micro --baseline baseline.json
+
+import sys
+import gc
+import json
+import platform
+import subprocess
+from time import perf_counter
+from numpy import arange, array, column_stack, cos, sin, isfinite, abs, \
+     pi, arccos, clip, einsum, mean, median, std, sqrt, \
+     __version__ as numpyVersion
+from numpy.random import default_rng
+
+from constants import TIMESTEP
+from landscape import landscape
+from engine import engine
+from airplane import airplane
+from geometry import vector
+from quat import quat
+from rigidbody import INTEGRATORS
+from units import ft2WU, WU2ft
+
+MAP = 'landscapes/16i__stonehenge.raw'
+SECTIONS = ('micro', 'raycast', 'integrators', 'adaptive')
+
+ROUNDS = 5 # processes the microbenchmark suite is run in, see micro
+SAMPLES = 10 # timed samples per microbenchmark per round
+SAMPLE_TIME = 0.02 # seconds, about how long each sample runs
+WARMUP = 0.2 # seconds each microbenchmark runs untimed first
+REGRESSION = 0.05 # slower than this fraction of the baseline is flagged
+# (if the confidence intervals don't overlap either)
+
+# Student's t for a two-sided 95% interval, by degrees of freedom
+T95 = {1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36,
+       8: 2.31, 9: 2.26, 10: 2.23, 12: 2.18, 15: 2.13, 20: 2.09, 30: 2.04}
+
+
+def timeit(f, repeats):
+    """ Runs f repeats times, returns the best time in seconds and the
+    last result """
+    best = None
+    for i in range(repeats):
+        start = perf_counter()
+        result = f()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def measure(f, setup=None, samples=SAMPLES, target=SAMPLE_TIME,
+            warmup=WARMUP):
+    """ Time calls of f, after calling it for warmup seconds. The number
+    of calls per sample is picked so a sample takes about target
+    seconds; setup, if given, is called (not timed) before each sample.
+    Returns the mean calls per second, the half width of its 95%
+    confidence interval, the median sample's calls per second and the
+    calls per sample. The median shrugs off the odd sample something
+    else on the machine slowed down. """
+
+    if setup is not None:
+        setup()
+    start = perf_counter()
+    while perf_counter() - start < warmup:
+        f()
+
+    # How many calls fill a sample
+    calls = 1
+    while True:
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        for i in range(calls):
+            f()
+        elapsed = perf_counter() - start
+        if elapsed >= target / 4:
+            break
+        calls *= 4
+    calls = int(calls * target / elapsed) or 1
+
+    rates = []
+    collecting = gc.isenabled()
+    gc.disable() # a collection in one sample isn't f's doing
+    try:
+        for k in range(samples):
+            if setup is not None:
+                setup()
+            start = perf_counter()
+            for i in range(calls):
+                f()
+            rates.append(calls / (perf_counter() - start))
+    finally:
+        if collecting:
+            gc.enable()
+    rates = array(rates)
+    df = samples - 1
+    t = T95[max(d for d in T95 if d <= df)] if df > 0 else 0.0
+    return float(mean(rates)), \
+           float(t * std(rates, ddof=1) / sqrt(samples)) if df > 0 else 0.0, \
+           float(median(rates)), calls
+
+
+def microbenchmarks(land):
+    """ The hot paths, as (name, function, setup) for measure """
+
+    a = vector(0.3, -1.2, 2.5)
+    b = vector(1.1, 0.4, -0.7)
+    p = quat.for_rotation(0.3, vector(1.0, 2.0, 0.5))
+    q = quat.for_rotation(-1.1, vector(0.2, -1.0, 3.0))
+
+    # The flight benchmarks go back to the same state before every
+    # sample, so they always time the same stretch of flight
+    plane = airplane()
+    plane.inputStick(0.1, -0.05)
+    for i in range(60):
+        plane.fly()
+    start = plane.snapshot()
+    reset = lambda: plane.restore(start)
+    body = plane.rigid
+
+    return [('geometry.vector', lambda: vector(0.3, -1.2, 2.5), None),
+            ('geometry.vector arithmetic',
+             lambda: a.cross(b).plus(a.scale(0.5)).norm(), None),
+            ('quat.times', lambda: p.times(q), None),
+            ('rigidBody.updatePositionsEuler',
+             lambda: body.updatePositionsEuler(TIMESTEP), reset),
+            ('airplane.fly', plane.fly, reset),
+            ('landscape.makeQuadsArray', land.makeQuadsArray, None)]
+
+
+def microRound(land):
+    """ One round of the microbenchmarks: the median calls per second of
+    each, by name """
+    return {name: measure(f, setup)[2]
+            for name, f, setup in microbenchmarks(land)}
+
+
+def micro(path, save=None, baseline=None, rounds=ROUNDS):
+    """ Run the microbenchmarks (on map file path), save them to JSON
+    file save and compare them against JSON file baseline (either can be
+    None). Returns the names of the ones that regressed.
+
+    Each round is a new process running microRound (see main). The
+    result is the mean of the rounds' medians, and its confidence
+    interval comes from how much they differ: samples taken back to
+    back in one process agree with each other much better than separate
+    runs do, so an interval from one run's samples alone makes ordinary
+    drift look like a regression. """
+
+    print("Microbenchmarks, calls per second with 95%% confidence "
+          "intervals (%d rounds of %d samples):" % (rounds, SAMPLES))
+    medians = {}
+    for k in range(rounds):
+        out = subprocess.run([sys.executable, __file__, '--round', path],
+                             stdout=subprocess.PIPE, check=True,
+                             universal_newlines=True).stdout
+        for name, rate in json.loads(out.splitlines()[-1]).items():
+            medians.setdefault(name, []).append(rate)
+
+    results = {}
+    df = rounds - 1
+    t = T95[max(d for d in T95 if d <= df)] if df > 0 else 0.0
+    for name in medians:
+        m = array(medians[name])
+        ops = float(mean(m))
+        ci = float(t * std(m, ddof=1) / sqrt(rounds)) if df > 0 else 0.0
+        results[name] = {'ops': ops, 'ci': ci, 'rounds': rounds,
+                         'samples': SAMPLES}
+        print("  %-32s %12.0f +/- %5.1f%%  (%.2f us per call)"
+              % (name, ops, 100 * ci / ops, 1e6 / ops))
+
+    if save is not None:
+        with open(save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'numpy': numpyVersion,
+                       'machine': platform.machine(),
+                       'results': results}, f, indent=2)
+        print("  saved to " + save)
+
+    regressed = []
+    if baseline is not None:
+        with open(baseline) as f:
+            old = json.load(f)['results']
+        print("Against " + baseline + ":")
+        for name, new in results.items():
+            if name not in old:
+                print("  %-32s not in the baseline" % name)
+                continue
+            change = new['ops'] / old[name]['ops'] - 1
+            apart = abs(new['ops'] - old[name]['ops']) > \
+                    new['ci'] + old[name]['ci']
+            if apart and change < -REGRESSION:
+                verdict = "SLOWER"
+                regressed.append(name)
+            elif apart and change > REGRESSION:
+                verdict = "faster"
+            else:
+                verdict = "no significant change"
+            print("  %-32s %+7.1f%%  %s" % (name, 100 * change, verdict))
+    return regressed
+
+
+def makeRays(count, seed=0):
+    """ Makes count rays starting around 12000 ft over the map, pointing
+    anywhere from 60 degrees down to 5 degrees up, like altimeter,
+    impact prediction and line of sight checks would. """
+
+    rng = default_rng(seed)
+    heading = rng.uniform(0, 2*pi, count)
+    pitch = rng.uniform(-pi/3, pi/36, count)
+    origins = column_stack((rng.uniform(-900, 900, count),
+                            ft2WU(rng.uniform(8000, 14000, count)),
+                            rng.uniform(-900, 900, count)))
+    directions = column_stack((cos(pitch)*sin(heading), sin(pitch),
+                               cos(pitch)*cos(heading)))
+    return origins, directions
+
+
+def raycast(land, count=2000, repeats=3):
+    """ Benchmark landscape.raycast against landscape.raymarch """
+
+    print("Ray casting, " + str(count) + " rays:")
+    origins, directions = makeRays(count)
+
+    fast, hits = timeit(lambda: land.raycast(origins, directions), repeats)
+    slow, marched = timeit(lambda: land.raymarch(origins, directions), 1)
+
+    agree = (isfinite(hits) == isfinite(marched)).mean()
+    both = isfinite(hits) & isfinite(marched)
+    error = abs(hits[both] - marched[both]).max() if both.any() else 0.0
+    report("pyramid raycast", count, fast)
+    report("brute-force march", count, slow)
+    print("  speedup: %.1fx, hit/miss agreement %.1f%%, max distance "
+          "difference %.3f" % (slow / fast, agree * 100, error))
+
+    # One ray at a time, the way a radar altimeter would call it. Each
+    # call pays a fixed numpy overhead, so batching rays is much quicker.
+    single = min(count, 200)
+    fast, hits = timeit(lambda: [land.raycast(origins[i], directions[i])
+                                 for i in range(single)], repeats)
+    slow, marched = timeit(lambda: [land.raymarch(origins[i], directions[i])
+                                    for i in range(single)], 1)
+    report("pyramid raycast, one ray per call", single, fast)
+    report("brute-force march, one ray per call", single, slow)
+    print("  speedup: %.1fx" % (slow / fast))
+
+
+def maneuver(t):
+    """ Controls for the integrator runs: a steady rolling pull with some
+    rudder. They're held constant, since controls sampled once per step
+    would otherwise differ between timesteps and swamp the integration
+    error. """
+    return 0.25, -0.15, 0.2
+
+
+def trajectory(integrator, dt, seconds, every):
+    """ Fly the maneuver with the given integrator and timestep.
+    Returns the positions and nose vectors every 'every' steps, the
+    wall clock time per step and the force evaluations per sim second.
+    integrator is a name from INTEGRATORS or a function(body, dt). """
+
+    sim = engine(controls=maneuver, dt=dt)
+    body = sim.plane.rigid
+    body.setIntegrator(integrator)
+    positions = [body.P.components()]
+    noses = [body.n.components()]
+    wall = 0.0
+    for i in range(int(round(seconds / dt / every))):
+        start = perf_counter()
+        sim.step(every)
+        wall += perf_counter() - start
+        positions.append(body.P.components())
+        noses.append(body.n.components())
+    return array(positions), array(noses), wall / sim.steps, \
+           body.evaluations / sim.time
+
+
+def errors(P, N, P0, N0):
+    """ The largest distance (ft) and attitude difference (degrees)
+    between the positions P and nose vectors N of a trajectory and those
+    of the reference, P0 and N0 """
+    distance = WU2ft(((P - P0)**2).sum(axis=1)**0.5).max()
+    angle = arccos(clip(einsum('ij,ij->i', N, N0), -1, 1)).max()
+    return distance, angle * 180 / pi
+
+
+def integrators(seconds=10.0, multiples=(1, 2, 4), refine=8):
+    """ Benchmark each integrator at timesteps of multiples * TIMESTEP
+    against RK4 at TIMESTEP / refine """
+
+    print("Integrators, %.0f s maneuver, error against RK4 at dt/%d:"
+          % (seconds, refine))
+    every = max(multiples)
+    P0, N0, cost, rate = trajectory('rk4', TIMESTEP / refine, seconds,
+                                    every * refine)
+    for m in multiples:
+        dt = TIMESTEP * m
+        for name in INTEGRATORS:
+            if name == 'adaptive':
+                continue # picks its own steps, see adaptive()
+            P, N, cost, rate = trajectory(name, dt, seconds, every // m)
+            error, angle = errors(P, N, P0, N0)
+            print("  dt %.3f %-14s %8.1f us/step  max position error "
+                  "%10.1f ft  max attitude error %6.2f deg"
+                  % (dt, name, cost * 1e6, error, angle))
+
+
+def adaptive(seconds=10.0, frame=16, refine=8,
+             tolerances=(1e-4, 1e-5, 1e-6, 1e-7)):
+    """ Benchmark rigidBody.advance at several tolerances, called every
+    frame * TIMESTEP seconds the way a batch run would, against RK4 at
+    TIMESTEP / refine, with semi-implicit Euler for comparison """
+
+    print("Adaptive integration, %.0f s maneuver in %.3f s frames:"
+          % (seconds, frame * TIMESTEP))
+    P0, N0, cost, rate = trajectory('rk4', TIMESTEP / refine, seconds,
+                                    frame * refine)
+    runs = [('semi-implicit', 'semi-implicit', TIMESTEP, frame)]
+    for tol in tolerances:
+        runs.append(('tolerance %g' % tol,
+                     lambda body, dt, tol=tol: body.advance(dt, tol),
+                     TIMESTEP * frame, 1))
+    for name, integrator, dt, every in runs:
+        P, N, cost, rate = trajectory(integrator, dt, seconds, every)
+        error, angle = errors(P, N, P0, N0)
+        print("  %-16s %6.0f force evaluations/s  %8.1f us per sim "
+              "second  max position error %8.2f ft  max attitude error "
+              "%6.3f deg" % (name, rate, cost * 1e6 / dt, error, angle))
+
+
+def report(name, rays, seconds):
+    """ Print a rays per second figure """
+    print("  %-36s %10.0f rays/s  (%.2f ms per ray)"
+          % (name, rays / seconds, 1000 * seconds / rays))
+
+
+def main(argv):
+    sections = [a for a in argv[1:] if a in SECTIONS] or SECTIONS
+    maps = [a for a in argv[1:] if a.endswith('.raw')]
+    save = argv[argv.index('--save') + 1] if '--save' in argv else None
+    baseline = argv[argv.index('--baseline') + 1] \
+               if '--baseline' in argv else None
+
+    path = maps[0] if maps else MAP
+    land = landscape(path)
+    if '--round' in argv:
+        print(json.dumps(microRound(land))) # for micro, in another process
+        return 0
+    regressed = []
+    if 'micro' in sections:
+        regressed = micro(path, save, baseline)
+    if 'raycast' in sections:
+        raycast(land)
+    if 'integrators' in sections:
+        integrators()
+    if 'adaptive' in sections:
+        adaptive()
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -12,4 +12,30 @@ FEET_PER_MILE = 6076
 AREA_FEET = AREA_MILES * FEET_PER_MILE
 GRAVITY = 32.2 # gravity acceleration value
 
-TIMESTEP = 0.017 # Timestep, used for integration (same as frame delay for now)
\ No newline at end of file
+FIELD_OF_VIEW = 60 # vertical, in degrees
+NEAR_CLIP = 0.001 # near and far clipping plane distances
+FAR_CLIP = 2500.0
+
+TIMESTEP = 0.017 # Timestep, used for integration (same as frame delay for now)
+MAX_SUBSTEPS = 5 # Most physics steps run per frame. If the sim falls further
+# behind than this, the rest is dropped (it runs slow instead of locking up)
+INTEGRATOR = 'semi-implicit' # How rigid bodies are stepped: 'euler',
+# 'semi-implicit', 'rk4', 'verlet' or 'adaptive' (see rigidbody.INTEGRATORS)
+ADAPTIVE_TOLERANCE = 1e-5 # Largest error per step for the 'adaptive'
+# integrator, relative to each state value (see rigidBody.advance)
+AIRFOIL = None # Airfoil the airplane uses: None for the built in one, or
+# the name of a CSV file in airfoils/ (see airfoil.py)
+WING_MODEL = 'point' # 'point': one lift force per wing; 'panels': each
+# wing split into WING_PANELS blade elements (see wing.py)
+WING_PANELS = 32
+RECORDER = None # File to record every flight to (see recorder.py), or None
+RECORDER_CAPACITY = 60 * 60 * 60 # Records it holds before the oldest are
+# overwritten: an hour of TIMESTEP steps
+KEYFRAME_INTERVAL = 300 # Steps between full state keyframes when recording
+# a flight for replay (see replay.py); seeking flies at most this many
+TRACE_CAPACITY = 200000 # Trace events kept in memory, see tracing.py
+TRACE_FILE = 'pyflight-trace.json' # Where pyflight writes a trace started
+# with the t key
+PROFILE_FRAMES = 300 # Frames the p key profiles, see profiling.capture
+PROFILE_FILE = 'pyflight-profile' # Start of the profile file names
+PROFILE_INTERVAL = 0.001 # Seconds between stack samples while profiling
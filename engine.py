@@ -0,0 +1,123 @@
+# engine.py
+#
+# Headless simulation engine for pyflight. Steps the airplane (and with it
+# every rigidBody) as fast as the CPU allows, without opening a window or
+# importing OpenGL / GLUT. Used for batch runs, CI, and anything else that
+# wants the flight model without the viewer in pyflight.py.
+#
+# Running this module flies the plane for a while and reports how fast
+# the simulation ran:
+#
+# > python3 engine.py [sim seconds] [integrator] [step seconds]
+#
+# e.g. "python3 engine.py 600 adaptive 0.25" flies with rigidBody.advance,
+# called every quarter second (see rigidbody.INTEGRATORS).
+
+import sys
+from time import perf_counter
+
+from constants import *
+from airplane import airplane
+from units import WU2ft, WUps2kts
+
+
+class scheduler:
+    # Decides how many fixed TIMESTEP physics steps to run each frame, so
+    # the sim runs at the same speed however fast frames are drawn.
+    # Real time piles up in an accumulator and is paid out in whole
+    # steps; the leftover fraction of a step is used to interpolate the
+    # rendered state between the last two physics states.
+
+    def __init__(s, dt=TIMESTEP, maxSteps=MAX_SUBSTEPS, clock=perf_counter):
+        """ Create a scheduler for steps of dt seconds, running at most
+        maxSteps steps per frame. clock returns the time in seconds. """
+        s.dt = dt
+        s.maxSteps = maxSteps
+        s.clock = clock
+        s.last = None # clock time of the last tick
+        s.accumulator = 0.0 # real time not yet simulated
+        s.dropped = 0.0 # real time thrown away by the maxSteps clamp
+
+    def tick(s):
+        """ Call once per frame. Returns how many physics steps to run
+        this frame. """
+        now = s.clock()
+        if s.last is not None:
+            s.accumulator += now - s.last
+        s.last = now
+
+        steps = int(s.accumulator // s.dt)
+        if steps > s.maxSteps:
+            # Too far behind to catch up - don't spiral, drop the rest
+            s.dropped += (steps - s.maxSteps) * s.dt
+            s.accumulator -= (steps - s.maxSteps) * s.dt
+            steps = s.maxSteps
+        s.accumulator -= steps * s.dt
+        return steps
+
+    def alpha(s):
+        """ How far (0 to 1) the present moment is between the last
+        physics state and the next one - use it to interpolate between
+        the previous and current state when rendering. """
+        if s.last is None:
+            return 1.0
+        a = (s.accumulator + s.clock() - s.last) / s.dt
+        return min(max(a, 0.0), 1.0)
+
+
+class engine:
+    # Drives an airplane with fixed steps (TIMESTEP by default), no
+    # rendering.
+
+    def __init__(s, plane=None, controls=None, dt=TIMESTEP):
+        """ Create an engine for airplane plane (a new one by default).
+        controls, if given, is called as controls(t) before every step and
+        returns the (stick x, stick y, rudder) inputs for sim time t. """
+
+        s.plane = plane if plane is not None else airplane()
+        s.controls = controls
+        s.dt = dt
+        s.steps = 0 # steps taken so far
+        s.time = 0.0 # simulated seconds so far
+
+    def step(s, n=1):
+        """ Advance the simulation n steps of s.dt seconds """
+        plane = s.plane
+        for i in range(n):
+            if s.controls is not None:
+                x, y, rudder = s.controls(s.time)
+                plane.inputStick(x, y)
+                plane.inputRudder(rudder)
+            plane.fly(s.dt)
+            s.steps += 1
+            s.time = s.steps * s.dt
+
+    def run(s, seconds):
+        """ Simulate for the given number of sim seconds. Returns the wall
+        clock time it took, in seconds. """
+        start = perf_counter()
+        s.step(int(round(seconds / s.dt)))
+        return perf_counter() - start
+
+
+def main(argv):
+    seconds = float(argv[1]) if len(argv) > 1 else 60.0
+    dt = float(argv[3]) if len(argv) > 3 else TIMESTEP
+
+    sim = engine(dt=dt)
+    plane = sim.plane
+    if len(argv) > 2:
+        plane.rigid.setIntegrator(argv[2])
+    wall = sim.run(seconds)
+
+    print("Simulated %.1f s (%d steps) in %.2f s: %.0f steps/s, "
+          "%.1f sim seconds per wall second"
+          % (sim.time, sim.steps, wall, sim.steps / wall, sim.time / wall))
+    print("%.0f force evaluations per sim second"
+          % (plane.rigid.evaluations / sim.time))
+    print("Final altitude %.0f ft, airspeed %.0f kts, AoA %.1f deg"
+          % (WU2ft(plane.altitude), WUps2kts(plane.airspeed),
+             plane.AngleOfAttack))
+
+
+if __name__ == '__main__': main(sys.argv)
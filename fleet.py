@@ -0,0 +1,205 @@
+# fleet.py
+#
+# Simulates many airplanes at once, for AI / traffic aircraft. Each
+# airplane flies the same flight model as airplane.py / rigidbody.py, but
+# instead of one airplane and one rigidBody object per aircraft, the
+# fleet keeps the state of all N aircraft in (N, ...) numpy arrays and
+# computes every force and integration step for all of them in a handful
+# of array operations.
+#
+# Orientation is kept as a unit quaternion per aircraft (w, x, y, z).
+# The body axes are x = right wing, y = up (lift), z = nose, as in
+# rigidBody.
+
+import sys
+from time import perf_counter
+from numpy import zeros, empty, full, arange, \
+     einsum, cross, sqrt, arccos, clip, where, pi, newaxis, ceil, diag
+
+from constants import *
+from units import ft2WU, kts2WUps, WUps2kts, WU2ft
+import airfoil
+import atmosphere
+
+# The same airframe constants airplane.py / rigidbody.py use:
+MASS = 100
+INERTIA = diag([0.177721, 0.304776, 0.177721]) * 100
+THRUST = ft2WU(2000)
+AIR_DENSITY = 0.001 # lbm/ft^3 at 12000 ft, see aeroState.update
+LIFT_SCALE = 70 # wing area and air density, see aeroState.update
+ROTATION_DAMPING = 0.1
+
+
+def rotationMatrices(q):
+    """ (N, 3, 3) rotation matrices for (N, 4) unit quaternions. Column
+    k is where body axis k points in world space. """
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    R = empty((len(q), 3, 3))
+    R[:, 0, 0] = 1 - 2*(y*y + z*z)
+    R[:, 0, 1] = 2*(x*y - w*z)
+    R[:, 0, 2] = 2*(x*z + w*y)
+    R[:, 1, 0] = 2*(x*y + w*z)
+    R[:, 1, 1] = 1 - 2*(x*x + z*z)
+    R[:, 1, 2] = 2*(y*z - w*x)
+    R[:, 2, 0] = 2*(x*z - w*y)
+    R[:, 2, 1] = 2*(y*z + w*x)
+    R[:, 2, 2] = 1 - 2*(x*x + y*y)
+    return R
+
+
+def rows(a, b):
+    """ Row-wise dot product of two (N, 3) arrays """
+    return einsum('ij,ij->i', a, b)
+
+
+class fleet:
+    # N airplanes, stored as arrays. Row i of each array is airplane i.
+
+    def __init__(s, n, altitude=ft2WU(12000), airspeed=kts2WUps(200),
+                 spacing=1.0):
+        """ Create n airplanes flying north at altitude (world units) and
+        airspeed (world units per second), straight and level, lined up
+        in a square grid spacing world units apart. """
+
+        s.n = n
+        side = int(ceil(n**0.5))
+        i = arange(n)
+
+        s.P = zeros((n, 3)) # positions
+        s.P[:, 0] = (i % side - (side - 1) / 2) * spacing
+        s.P[:, 1] = altitude
+        s.P[:, 2] = (i // side - (side - 1) / 2) * spacing
+        s.q = zeros((n, 4)) # orientations
+        s.q[:, 0] = 1.0
+        s.M = full(n, float(MASS)) # masses
+        s.LM = zeros((n, 3)) # linear momenta
+        s.LM[:, 2] = airspeed * s.M
+        s.AM = zeros((n, 3)) # angular momenta
+        s.Ibodyinv = diag(1.0 / diag(INERTIA)) # body frame inverse inertia
+
+        # Control inputs, same ranges as airplane.inputStick / inputRudder
+        s.x = zeros(n)
+        s.y = zeros(n)
+        s.r = zeros(n)
+
+        # Derived state, updated by fly()
+        s.V = s.LM / s.M[:, newaxis]
+        s.R = rotationMatrices(s.q)
+        s.AoA = zeros(n)
+        s.warning = zeros(n, dtype=bool)
+        s.time = 0.0
+        s.airfoil = airfoil.get(AIRFOIL) # shared with airplane.py
+        s.atmosphere = atmosphere.standard
+
+    def inputStick(s, x, y):
+        """ Set the stick positions - numbers (for every airplane) or
+        length n arrays """
+        s.x[:] = x
+        s.y[:] = y
+
+    def inputRudder(s, rudder_input):
+        """ Set the rudder inputs - a number or a length n array """
+        s.r[:] = rudder_input
+
+    def altitude(s):
+        """ Altitudes, in world units """
+        return s.P[:, 1]
+
+    def airspeed(s):
+        """ Airspeeds, in world units per second """
+        return sqrt(rows(s.V, s.V))
+
+    def forces(s):
+        """ Compute the total force and torque on every airplane, as two
+        (n, 3) arrays. Same forces as airplane.py registers on its
+        rigidBody: thrust, drag, gravity, the wings, elevator, rudder and
+        stabilizer. """
+
+        R = s.R
+        right = R[:, :, 0]
+        up = R[:, :, 1]
+        nose = R[:, :, 2]
+        V = s.V
+
+        speed = sqrt(rows(V, V))
+        moving = speed > EPSILON
+        unitV = V / where(moving, speed, 1.0)[:, newaxis]
+
+        # Angle of attack: the angle between nose and velocity, negative
+        # when the velocity has an upward component along the lift axis
+        angle = where(moving, arccos(clip(rows(nose, unitV), -1, 1)), 0.0)
+        aoa = angle * (180 / pi)
+        aoa = where(moving & (rows(unitV, up) > 0), -aoa, aoa)
+        s.AoA = aoa
+        s.warning = aoa > 30
+
+        kts = WUps2kts(speed)
+        foil = s.airfoil
+        cl = foil.CoL(aoa, kts)
+        density = s.atmosphere.ratio(WU2ft(s.P[:, 1])) # relative to 12000 ft
+        lift = up * (foil.multiplier(kts) * cl * LIFT_SCALE
+                     * density)[:, newaxis]
+
+        fps = kts * 6076 / 3600
+        drag = V * (-1/2 * AIR_DENSITY * density * foil.CoD(aoa)
+                    * fps**2)[:, newaxis]
+
+        leftWing = lift * ((1 - s.x) / 2)[:, newaxis]
+        rightWing = lift * ((1 + s.x) / 2)[:, newaxis]
+        tail = lift * (-s.y / 2)[:, newaxis] \
+               + cross(lift, nose) * (s.r * 0.15)[:, newaxis] \
+               + (nose - unitV) * (cl * 2)[:, newaxis]
+
+        F = nose * THRUST + drag + leftWing + rightWing + tail
+        F[:, 1] -= ft2WU(32.2) * s.M
+
+        # Wings act at -/+ the right axis, the tail at -nose
+        torque = cross(right, rightWing - leftWing) - cross(nose, tail) \
+                 - s.AM * ROTATION_DAMPING
+        return F, torque
+
+    def fly(s, dt=TIMESTEP):
+        """ Advance every airplane by dt seconds, with the same semi
+        implicit Euler step rigidBody uses: momentum first, then position
+        and orientation from the new velocities. """
+
+        F, torque = s.forces()
+        s.LM += F * dt
+        s.AM += torque * dt
+        s.V = s.LM / s.M[:, newaxis]
+
+        # World space angular velocity: R Ibody^-1 R^T L
+        R = s.R
+        omega = einsum('nji,nj->ni', R, s.AM).dot(s.Ibodyinv.T)
+        omega = einsum('nij,nj->ni', R, omega)
+
+        s.P += s.V * dt
+
+        # dq/dt = 1/2 (0, omega) q
+        w, v = s.q[:, 0], s.q[:, 1:]
+        dq = empty(s.q.shape)
+        dq[:, 0] = -rows(omega, v)
+        dq[:, 1:] = omega * w[:, newaxis] + cross(omega, v)
+        s.q += dq * (dt / 2)
+        s.q /= sqrt(einsum('ij,ij->i', s.q, s.q))[:, newaxis]
+        s.R = rotationMatrices(s.q)
+        s.time += dt
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 10000
+    seconds = float(argv[2]) if len(argv) > 2 else 10.0
+
+    f = fleet(n)
+    steps = int(round(seconds / TIMESTEP))
+    start = perf_counter()
+    for i in range(steps):
+        f.fly()
+    wall = perf_counter() - start
+
+    print("%d airplanes, %d steps in %.2f s: %.2f ms per step, %.1fx "
+          "real time" % (n, steps, wall, 1000 * wall / steps,
+                         steps * TIMESTEP / wall))
+
+
+if __name__ == '__main__': main(sys.argv)
@@ -12,6 +12,14 @@
 #    vector: a class of offsets between points within 3-space
 #    ORIGIN: a point at the origin 
 #
+# plus arrayPoint and arrayVector, versions of point and vector whose
+# coordinates live in (a slice of) a numpy array.
+#
+# Points and vectors are slotted, and besides the usual operations that
+# return new objects, they have in-place versions (set, iadd, isub,
+# iscale, ...) that modify and return self, for hot loops that shouldn't
+# allocate.
+#
 # The two classes/datatypes are designed based on Chapter 3 of
 # "Coordinate-Free Geometric Programming" (UW-CSE TR-89-09-16)
 # by Tony DeRose.
@@ -20,7 +28,6 @@
 from random import random
 from math import sqrt, pi, sin, cos, acos
 from constants import EPSILON
-from OpenGL.GL import *
 from numpy import *
 
 
@@ -30,6 +37,8 @@ from numpy import *
 #
 class point:
 
+    __slots__ = ('x','y','z')
+
     def __init__(self,_x,_y,_z):
         """ Construct a new point instance from its coordinates. """
         self.x = _x
@@ -47,6 +56,7 @@ class point:
 
     def glVertex3(self):
         """ Issues a glVertex3f call with the coordinates of self. """
+        from OpenGL.GL import glVertex3f # only needed when drawing
         glVertex3f(self[0],self[1],self[2])
 
     def plus(self,offset):
@@ -93,6 +103,31 @@ class point:
         """ returns this vector as a numpy array """
         return array([self.x, self.y, self.z])
 
+    #
+    # In-place versions. These modify self, and return it.
+    #
+
+    def set(self,_x,_y,_z):
+        """ Sets the coordinates of self. """
+        self.x = _x
+        self.y = _y
+        self.z = _z
+        return self
+
+    def set_to(self,other):
+        """ Sets self to the same location as point other. """
+        return self.set(other.x,other.y,other.z)
+
+    def iadd(self,offset):
+        """ Moves self by vector offset. """
+        return self.set(self.x+offset.dx,self.y+offset.dy,self.z+offset.dz)
+
+    def iadd_scaled(self,scalar,offset):
+        """ Moves self by scalar times vector offset. """
+        return self.set(self.x+scalar*offset.dx,
+                        self.y+scalar*offset.dy,
+                        self.z+scalar*offset.dz)
+
     #
     # Special methods, hooks into Python syntax.
     #
@@ -113,7 +148,7 @@ class point:
 
     def __getitem__(self,i):
         """ Defines p[i] """
-        return (self.components())[i]
+        return (self.x,self.y,self.z)[i]
 
 
 #
@@ -121,6 +156,8 @@ class point:
 #
 class vector:
 
+    __slots__ = ('dx','dy','dz')
+
     def __init__(self,_dx,_dy,_dz):
         """ Construct a new vector instance. """
         self.dx = _dx
@@ -209,6 +246,56 @@ class vector:
                       [self.dz, 0 -self.dx],
                       [-self.dy, self.dx, 0]]
 
+    #
+    # In-place versions. These modify self, and return it.
+    #
+
+    def set(self,_dx,_dy,_dz):
+        """ Sets the components of self. """
+        self.dx = _dx
+        self.dy = _dy
+        self.dz = _dz
+        return self
+
+    def set_to(self,other):
+        """ Sets self to the same components as vector other. """
+        return self.set(other.dx,other.dy,other.dz)
+
+    def iadd(self,other):
+        """ Adds other to self. """
+        return self.set(self.dx+other.dx,self.dy+other.dy,self.dz+other.dz)
+
+    def isub(self,other):
+        """ Subtracts other from self. """
+        return self.set(self.dx-other.dx,self.dy-other.dy,self.dz-other.dz)
+
+    def iadd_scaled(self,scalar,other):
+        """ Adds scalar times other to self. """
+        return self.set(self.dx+scalar*other.dx,
+                        self.dy+scalar*other.dy,
+                        self.dz+scalar*other.dz)
+
+    def iscale(self,scalar):
+        """ Scales self by the given value. """
+        return self.set(scalar*self.dx,scalar*self.dy,scalar*self.dz)
+
+    def ineg(self):
+        """ Flips the direction of self. """
+        return self.set(-self.dx,-self.dy,-self.dz)
+
+    def icross(self,other):
+        """ Sets self to the cross product of self with other. """
+        return self.set(self.dy*other.dz-self.dz*other.dy,
+                        self.dz*other.dx-self.dx*other.dz,
+                        self.dx*other.dy-self.dy*other.dx)
+
+    def iunit(self):
+        """ Scales self to unit length (see unit). """
+        n = self.norm()
+        if n < EPSILON:
+            return self.set(1.0,0.0,0.0)
+        return self.iscale(1.0/n)
+
     def angleBetween(self, other):
         """ Gets the angle between this vector and another, in radians """
         nself = self.norm()
@@ -254,7 +341,47 @@ class vector:
 
     def __getitem__(self,i):
         """ Defines v[i] """
-        return (self.components())[i]
+        return (self.dx,self.dy,self.dz)[i]
+
+
+#
+# Points and vectors stored in numpy arrays. These work anywhere a point
+# or vector does, but read and write their coordinates from the first
+# three entries of an array (or array slice) - e.g. a vertex buffer, or a
+# rigid body's state - instead of keeping their own. Operations that make
+# new objects (plus, scale, ...) still return plain points and vectors.
+#
+def _coordinate(i):
+    """ A property for coordinate i of an array-backed object. """
+    def get(self):
+        return self.array.item(i)
+    def put(self,value):
+        self.array[i] = value
+    return property(get,put)
+
+class arrayPoint(point):
+
+    __slots__ = ('array',)
+
+    x = _coordinate(0)
+    y = _coordinate(1)
+    z = _coordinate(2)
+
+    def __init__(self,a):
+        """ Construct a point whose coordinates are a[0], a[1], a[2]. """
+        self.array = a
+
+class arrayVector(vector):
+
+    __slots__ = ('array',)
+
+    dx = _coordinate(0)
+    dy = _coordinate(1)
+    dz = _coordinate(2)
+
+    def __init__(self,a):
+        """ Construct a vector whose components are a[0], a[1], a[2]. """
+        self.array = a
 
 # 
 # The point at the origin.
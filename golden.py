@@ -0,0 +1,138 @@
+# golden.py
+#
+# Golden trajectory checks for the flight model. Each scenario flies the
+# airplane headlessly (through engine.py) with canned control inputs, and
+# the trajectory - position and orientation after every step - is
+# compared against the one stored in golden/<scenario>.npz. Each scenario
+# reports how fast it ran (sim steps per wall second) next to how far it
+# strayed from the golden run (position in feet, attitude in degrees), so
+# a physics optimization is judged on speed and accuracy in one run. It
+# fails if either error is over the scenario's tolerance.
+#
+# > python3 golden.py [scenario ...] [--integrator name] [--dt seconds]
+# > python3 golden.py --update
+#
+# --update rewrites the golden files from the current code; only do that
+# when a change to the flight behavior is meant. The golden files were
+# made with the defaults in constants.py (semi-implicit Euler at
+# TIMESTEP). A --dt has to be a whole multiple of TIMESTEP; it is compared
+# at the golden steps it lands on. The exit status is 1 if any scenario
+# fails, 2 if the --dt isn't a multiple.
+
+import sys
+from os.path import join, dirname
+from time import perf_counter
+from numpy import array, zeros, savez, load, arccos, clip, abs, einsum, pi
+
+from constants import TIMESTEP
+from engine import engine
+from units import WU2ft
+
+GOLDEN = join(dirname(__file__), 'golden') # where the golden files are
+
+# name: (controls(t) -> stick x, stick y, rudder; sim seconds; position
+# tolerance in feet; attitude tolerance in degrees)
+SCENARIOS = {
+    # A little back stick: the nose comes up slowly, ~900 ft gained
+    'climb': (lambda t: (0.0, 0.005, 0.0), 12.0, 1.0, 0.05),
+    # Holding the stick back until the airspeed bleeds off and the
+    # stall warning comes on
+    'stall': (lambda t: (0.0, 0.02, 0.0), 12.0, 5.0, 0.5),
+    # Full right stick
+    'roll': (lambda t: (0.5, 0.0, 0.0), 6.0, 5.0, 0.5),
+}
+
+
+def fly(controls, seconds, integrator=None, dt=TIMESTEP):
+    """ Fly a new airplane seconds sim seconds with controls. Returns the
+    position and orientation quaternion after every step (and at the
+    start), and the wall clock seconds the steps took. """
+
+    sim = engine(controls=controls, dt=dt)
+    body = sim.plane.rigid
+    if integrator is not None:
+        body.setIntegrator(integrator)
+    steps = int(round(seconds / dt))
+    P = zeros((steps + 1, 3))
+    Q = zeros((steps + 1, 4))
+    P[0] = body.pos
+    Q[0] = body.rot
+    wall = 0.0
+    for i in range(1, steps + 1):
+        start = perf_counter()
+        sim.step()
+        wall += perf_counter() - start
+        P[i] = body.pos
+        Q[i] = body.rot
+    return P, Q, wall
+
+
+def errors(P, Q, P0, Q0):
+    """ The largest position difference (ft) and attitude difference
+    (degrees, the angle of the rotation between the orientations) of
+    trajectory P, Q from P0, Q0 """
+    distance = WU2ft(((P - P0)**2).sum(axis=1)**0.5).max()
+    cosine = clip(abs(einsum('ij,ij->i', Q, Q0)), 0.0, 1.0)
+    return distance, (2 * arccos(cosine)).max() * 180 / pi
+
+
+def path(name):
+    return join(GOLDEN, name + '.npz')
+
+
+def update(name):
+    """ Fly scenario name with the defaults and save it as golden """
+    controls, seconds, position, attitude = SCENARIOS[name]
+    P, Q, wall = fly(controls, seconds)
+    savez(path(name), dt=TIMESTEP, P=P, Q=Q)
+    print("  %-8s %5d steps written to %s" % (name, len(P) - 1, path(name)))
+
+
+def check(name, integrator=None, dt=TIMESTEP):
+    """ Fly scenario name and compare it with its golden file. Prints a
+    report line, returns whether it is within tolerance. Raises
+    ValueError if dt isn't a whole multiple of the golden file's step. """
+
+    controls, seconds, position, attitude = SCENARIOS[name]
+    golden = load(path(name))
+    every = int(round(dt / float(golden['dt'])))
+    if every < 1 or abs(every * float(golden['dt']) - dt) > 1e-9 * dt:
+        raise ValueError("--dt %g isn't a whole multiple of the golden "
+                         "step, %g" % (dt, float(golden['dt'])))
+    P0 = golden['P'][::every]
+    Q0 = golden['Q'][::every]
+
+    P, Q, wall = fly(controls, seconds, integrator, dt)
+    n = min(len(P), len(P0))
+    distance, angle = errors(P[:n], Q[:n], P0[:n], Q0[:n])
+    ok = distance <= position and angle <= attitude
+    print("  %-8s %8.0f steps/s  position error %9.3f ft (%g)  attitude "
+          "error %7.3f deg (%g)  %s"
+          % (name, (len(P) - 1) / wall, distance, position, angle, attitude,
+             "ok" if ok else "FAIL"))
+    return ok
+
+
+def main(argv):
+    names = [a for a in argv[1:] if a in SCENARIOS] or list(SCENARIOS)
+    integrator = argv[argv.index('--integrator') + 1] \
+                 if '--integrator' in argv else None
+    dt = float(argv[argv.index('--dt') + 1]) if '--dt' in argv \
+         else TIMESTEP
+
+    if '--update' in argv:
+        print("Updating golden trajectories:")
+        for name in names:
+            update(name)
+        return 0
+
+    print("Golden trajectories (tolerances in brackets):")
+    try:
+        failed = [name for name in names if not check(name, integrator, dt)]
+    except ValueError as e:
+        print(e)
+        return 2
+    return 1 if failed else 0
+
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -16,6 +16,7 @@ from geometry import *
 from quat import *
 from airplane import *
 from constants import *
+from profiling import timers, COLORS
 
 from numpy import *
 from math import sin, cos, sqrt
@@ -25,10 +26,13 @@ from quat import *
 class hud:
 
 
-    def __init__(s, plane):
-        """ Creates a HUD for the airplane object plane """
+    def __init__(s, plane, frameTimers=None):
+        """ Creates a HUD for the airplane object plane. frameTimers are
+        the profiling.timers the frame time graph shows. """
 
         s.plane = plane
+        s.timers = frameTimers if frameTimers is not None else timers()
+        s.showGraph = False # the frame time graph, see toggleGraph
         s.P = None
         s.Nose = None
         s.Up = None
@@ -38,9 +42,19 @@ class hud:
         s.warningsDisplayed = 0
         s.Displaying = False
 
-        # Vertex arrays for each hud element
-        s.horizon_verts = list(range(12))
-        s.fpm_verts = list(range(36))
+        # Vertex arrays for each hud element, and points that write
+        # straight into them
+        s.horizon_verts = zeros(12, dtype=float32)
+        s.fpm_verts = zeros(36, dtype=float32)
+        s.horizon_points = [arrayPoint(s.horizon_verts[3*i:3*i+3])
+                            for i in range(4)]
+        s.fpm_points = [arrayPoint(s.fpm_verts[3*i:3*i+3])
+                        for i in range(12)]
+
+        # Scratch space for working them out
+        s.h = vector(0.0, 0.0, 0.0)
+        s.center = point(0.0, 0.0, 0.0)
+        s.marker = [point(0.0, 0.0, 0.0) for i in range(6)]
     
         s.getPlaneState()
 
@@ -85,6 +99,30 @@ class hud:
         return output.encode('utf-8')
 
 
+    def toggleGraph(s):
+        """ Show or hide the frame time graph. The frame timers only run
+        while it's shown. """
+        s.showGraph = not s.showGraph
+        if s.timers.enabled != s.showGraph:
+            s.timers.toggle()
+
+    def getFrameGraph(s, width, height):
+        """ Vertices and colors of the frame time graph, for GL_LINES, in
+        a window width by height pixels: a bar per frame, stacked by
+        phase, in the bottom left corner. Full height is two frames. """
+        return s.timers.graph(10, height - 10, width * 0.4, height * 0.2,
+                              2 * DELAY)
+
+    def getFrameStats(s):
+        """ The median and 99th percentile time of each phase and of the
+        whole frame, as (color, cstring) pairs for display """
+        stats = s.timers.percentiles((50, 99)) * 1000
+        names = s.timers.phases + ('frame',)
+        colors = COLORS[:len(s.timers.phases)] + ((1.0, 1.0, 1.0),)
+        return [(color, ("%-10s p50 %5.2f ms  p99 %5.2f ms"
+                         % (name, p50, p99)).encode('utf-8'))
+                for name, color, (p50, p99) in zip(names, colors, stats)]
+
     def getBitchinBetty(s):
         """ Returns the bitchin' betty string, basically a warning
         or whatever. Mostly for debugging. The warning will blink
@@ -119,7 +157,6 @@ class hud:
         """ Gets the current state of the plane """
 
         s.P = s.plane.rigid.P
-        s.x = vector(s.plane.rigid.P.x, s.plane.rigid.P.y, s.plane.rigid.P.z)
         s.Nose = s.plane.rigid.nose
         s.Up = s.plane.rigid.lift
         s.airspeed = s.plane.airspeed
@@ -142,21 +179,11 @@ class hud:
         # The horizon is normal to the lift vector and the nose.
         #c = s.Nose.cross(vector(0.0, 1.0, 0.0).unit()
         
-        c = vector(s.Nose.dx, 0.0, s.Nose.dz)
-        h = c.cross(vector(0.0, 1.0, 0.0))
-        h = h.unit()
+        # h = (nose flattened) x (0, 1, 0)
+        h = s.h.set(-s.Nose.dz, 0.0, s.Nose.dx).iunit()
         # Get the points that we should actually draw:
-        v = list(range(4))
-        v[0] = s.P+(s.Nose + h.scale(0.07))
-        v[1] = s.P+(s.Nose + h.scale(0.5))
-        v[2] = s.P+(s.Nose + h.scale(-0.07))
-        v[3] = s.P+(s.Nose + h.scale(-0.5))
-
-        
-        for i in range(4):
-            z = v[i].components()
-            for ii in range(3):
-                s.horizon_verts[3*i+ii] = z[ii]
+        for v, d in zip(s.horizon_points, (0.07, 0.5, -0.07, -0.5)):
+            v.set_to(s.P).iadd(s.Nose).iadd_scaled(d, h)
 
                 
     def FPM(s):
@@ -165,39 +192,23 @@ class hud:
             
         # The FMP is a just a marker of the velocity vector.
         
-        center = s.P + s.plane.rigid.V.unit()
-        temp = vector(s.Nose.dx, 0.0, s.Nose.dz)
-        h = temp.cross(vector(0.0, 1.0, 0.0)).unit() # horizon vector
+        center = s.center.set_to(s.P).iadd(s.plane.rigid.V.unit())
+        # horizon vector, (nose flattened) x (0, 1, 0)
+        h = s.h.set(-s.Nose.dz, 0.0, s.Nose.dx).iunit()
         #h = temp.cross(s.plane.rigid.lift).unit()
-        up = vector(0.0, 1.0, 0.0) # vertical vector
-
-        v = list(range(6))
-        v[0] = center + up.scale(0.02)
-        v[1] = center + h.scale(0.02)
-        v[2] = center + up.scale(-0.02)
-        v[3] = center + h.scale(-0.02)
-        v[4] = center + h.scale(-0.04)
-        v[5] = center + h.scale(0.04)
-        
-        # Make the diamond
-        for i in range(4):
-            z1 = v[i].components()
-            z2 = v[(i+1) % 4].components()
-            for ii in range(3):
-                s.fpm_verts[6*i+ii] = z1[ii]
-                s.fpm_verts[6*i+ii+3] = z2[ii]
-
-        # Make the wingies
-        v3 = v[3].components()
-        v1 = v[1].components()
-        v5 = v[5].components()
-        v4 = v[4].components()
-        
-        for i in range(3):
-            s.fpm_verts[24+i] = v3[i]
-            s.fpm_verts[27+i] = v4[i]
-            s.fpm_verts[30+i] = v1[i]
-            s.fpm_verts[33+i] = v5[i]
+
+        v = s.marker
+        v[0].set_to(center).y += 0.02 # up along the vertical
+        v[1].set_to(center).iadd_scaled(0.02, h)
+        v[2].set_to(center).y -= 0.02
+        v[3].set_to(center).iadd_scaled(-0.02, h)
+        v[4].set_to(center).iadd_scaled(-0.04, h)
+        v[5].set_to(center).iadd_scaled(0.04, h)
+        
+        # Make the diamond, then the wingies
+        lines = (0, 1, 1, 2, 2, 3, 3, 0, 3, 4, 1, 5)
+        for p, i in zip(s.fpm_points, lines):
+            p.set_to(v[i])
                 
         
     def instruments(s):
@@ -206,8 +217,9 @@ class hud:
         s.airspeed = WUps2kts(s.airspeed)
         s.altitude = WU2ft(s.altitude)
         s.VVI = WU2ft(s.plane.rigid.V.dy) 
-        s.debug1 = s.plane.lift(s.plane.rigid).norm()
-        s.debug2 = s.plane.drag(s.plane.rigid).norm()
+        aero = s.plane.aero(s.plane.rigid) # shared with the forces
+        s.debug1 = aero.lift.norm()
+        s.debug2 = aero.drag.norm()
         
         
         
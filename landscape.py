@@ -14,11 +14,14 @@
 
 
 
-from OpenGL.GL import *
-
-from struct import *
+from os.path import getsize
 from constants import *
-from numpy import array, matrix, zeros
+from quadtree import quadtree
+from tracing import tracer, traced
+from numpy import array, matrix, zeros, empty, full, arange, stack, \
+     newaxis, fromfile, dtype, float32, float64, uint32, asarray, clip, \
+     floor, minimum, maximum, where, ndim, sqrt, isfinite, inf, errstate, \
+     intp, concatenate
 
 # landscape constants
     
@@ -26,9 +29,12 @@ MAP_SIZE = AREA_SIZE
 IMAGE_SIZE = 256 # per side.
 PIXELS = 256*256
 HEIGHTMAP_RAW_MAX = 65535 # 16 bit heightmap
+HEADER_SIZE = 2 # bytes skipped at the start of each .raw file
+RAW_DTYPE = dtype('<u2') # samples are little-endian unsigned 16 bit
 STEP_SIZE = MAP_SIZE / IMAGE_SIZE # How far apart each vertex is
 HEIGHT_RATIO = 0.0020 # terrain scaling constant
 RADIUS = MAP_SIZE // 2
+RAY_JUMP = 4 # pyramid levels raycast goes down at a time
 
 # at 10000ft. This corresponds to max hill height of about 6000ft, but
 # 0.003 seems to be a good scaling factor, creating nice, rolling hills
@@ -38,106 +44,380 @@ RADIUS = MAP_SIZE // 2
 class landscape:
     # Height mapped landscape class
    
+    @traced('landscape', 'load')
     def __init__(self, filepath):
         """ Initialize the landscape, loading from file at FILEPATH """
 
-        self.pixels = zeros(shape=(IMAGE_SIZE, IMAGE_SIZE))
-        self.verts = []
+        self.size = IMAGE_SIZE # samples per side, set by loadRawFile
+        self.step = STEP_SIZE # distance between vertices
+        self.pixels = zeros(shape=(IMAGE_SIZE, IMAGE_SIZE), dtype=RAW_DTYPE)
+        self.heights = None # self.pixels in world units, for queries
+        self.verts = None # vertex grid, built by makeQuadsArray
+        self.indices = None # triangle index buffer
+        self.tree = None # chunked quadtree, for LOD / culled drawing
+        self.maxPyramid = [] # min/max mip pyramids, for ray casting
+        self.minPyramid = []
 
 
         # Load the file
         self.loadRawFile(filepath)
+        self.heights = self.pixels * HEIGHT_RATIO
+        self.makePyramid()
         # Load the file infomation into 3d heightmap coordinates,
         # ready to be interpreted as a openGL quads:
         self.makeQuadsArray()
+        # Split the mesh into chunks for level of detail drawing:
+        t = tracer.begin()
+        self.tree = quadtree(self)
+        tracer.end('quadtree', t, 'load')
         
         
 
+    @traced('landscape.loadRawFile', 'load')
     def loadRawFile(self, filepath):
-        """ Load a .raw heightmap into the matrix self.pixels """
+        """ Load a .raw heightmap into the uint16 array self.pixels.
+
+        The file is a HEADER_SIZE byte header followed by little-endian
+        16 bit samples. The map is the largest square that fits in the
+        samples after the header (256x256 or 128x128 for the maps
+        in landscapes/), read with a single bulk read. """
         
         print("Loading " + filepath)
-        f = open(filepath, "rb") # read byte mode
 
-        byte = f.read(2)
+        samples = (getsize(filepath) - HEADER_SIZE) // RAW_DTYPE.itemsize
+        side = int(sqrt(samples)) # the biggest square that fits...
+        while side * side > samples:
+            side -= 1
+        while (side + 1) * (side + 1) <= samples:
+            side += 1 # ...even if sqrt rounded the wrong way
+        if side < 2:
+            raise ValueError(filepath + " is too small to be a heightmap")
 
-        for i in range(IMAGE_SIZE):
-            for ii in range(IMAGE_SIZE):
-                byte = f.read(2)
-                value=unpack('H', byte)
-                self.pixels[i, ii] = value[0]
+        self.pixels = fromfile(filepath, dtype=RAW_DTYPE, count=side*side,
+                               offset=HEADER_SIZE).reshape(side, side)
+        self.size = side
+        self.step = MAP_SIZE / side
             
-        print("Heightmap loaded.")
-        print(self.pixels)
-        print("MAX:")
-        print(self.pixels.max())
-        print("MIN:")
-        print(self.pixels.min())
+        print("Heightmap loaded: " + str(side) + "x" + str(side) +
+              ", min " + str(self.pixels.min()) +
+              ", max " + str(self.pixels.max()))
         
 
+    @traced('landscape.makeQuadsArray', 'load')
     def makeQuadsArray(self):
-        """ Convert the 2d matrix of image pixels into an array
-        of OpenGL coordinates, scaled to our map size. """ 
-
-        # vertices will be added to the vertex array row
-        # at a time. The terrain is centered at the origin, and
-        # stretches across a MAP_SIZE sized area.
+        """ Convert the 2d matrix of image pixels into an indexed
+        triangle mesh, scaled to our map size. self.verts gets one
+        float32 (x, y, z) vertex per pixel, self.indices gets six uint32
+        indices (two triangles) per quad. """ 
 
-     
+        # The terrain is centered at the origin, and stretches across a
+        # MAP_SIZE sized area. Pixel (row, col) becomes vertex
+        # row*size + col.
+        n = self.size
+        coords = arange(n, dtype=float32) * float32(self.step)
 
-        #for i in range(125,126):
-        for i in range(IMAGE_SIZE-1):
-            for ii in range(IMAGE_SIZE-1):
-                self.appendQuadCoords(i, ii)
+        self.verts = empty((n, n, 3), dtype=float32)
+        self.verts[:, :, 0] = coords - RADIUS # x grows with the column
+        self.verts[:, :, 1] = self.pixels * float32(HEIGHT_RATIO)
+        self.verts[:, :, 2] = (RADIUS - coords)[:, newaxis] # z shrinks
+        # with the row
+        self.verts = self.verts.reshape(n*n, 3)
 
+        # Corners of every quad: q1 top left, q2 top right, q3 bottom
+        # left, q4 bottom right. Triangles are (q1, q2, q3), (q2, q3, q4).
+        q1 = (arange(n-1, dtype=uint32)[:, newaxis] * n
+              + arange(n-1, dtype=uint32)).ravel()
+        q2 = q1 + 1
+        q3 = q1 + n
+        q4 = q3 + 1
+        self.indices = stack((q1, q2, q3, q2, q3, q4), axis=1).ravel()
 
-        
-        
-    def appendQuadCoords(self, x, y):
-        """ appends the quadrilateral coordinates for pixel at (x,y) to the
-        vertex list """
-        
-        ycoord = RADIUS - y*STEP_SIZE
-        xcoord = (-RADIUS) + x*STEP_SIZE
-                    
-        q1 = [xcoord, self.pixels[y][x]*HEIGHT_RATIO, ycoord]
-        q2 = [xcoord+STEP_SIZE, self.pixels[y][x+1]*HEIGHT_RATIO, ycoord]
-        q3 = [xcoord, self.pixels[y+1][x]*HEIGHT_RATIO, ycoord-STEP_SIZE]
-        q4 = [xcoord+STEP_SIZE, self.pixels[y+1][x+1]*HEIGHT_RATIO, ycoord-STEP_SIZE]
-
-        self.verts.extend(q1)
-        self.verts.extend(q2)
-        self.verts.extend(q3)
-        self.verts.extend(q2)
-        self.verts.extend(q3)
-        self.verts.extend(q4)
 
     def draw(self):
         """ draws the landscape without using a buffer. Slow!! """
 
+        from OpenGL.GL import glBegin, glEnd, glVertex3f, GL_TRIANGLES
         glBegin(GL_TRIANGLES)
 
-        for i in range(0, len(self.verts), 3):
-            glVertex3f(self.verts[i], self.verts[i+1], self.verts[i+1])
+        for i in self.indices:
+            glVertex3f(*self.verts[i])
 
         glEnd()
 
+    def heightAt(self, x, z):
+        """ Returns the ground height, in world units, under world
+        coordinates (x, z). x and z can be numbers or numpy arrays (of
+        the same shape, or anything that broadcasts), in which case an
+        array of heights is returned. Heights are bilinearly interpolated
+        between pixels; points off the map get the height at the nearest
+        edge. """
+
+        n = self.size
+        # Convert to (fractional) pixel coordinates - see makeQuadsArray
+        col = clip((asarray(x, dtype=float64) + RADIUS) / self.step, 0, n-1)
+        row = clip((RADIUS - asarray(z, dtype=float64)) / self.step, 0, n-1)
+
+        c0 = minimum(floor(col), n-2).astype(int)
+        r0 = minimum(floor(row), n-2).astype(int)
+        fc = col - c0
+        fr = row - r0
+
+        h = self.heights
+        top = h[r0, c0] + (h[r0, c0+1] - h[r0, c0]) * fc
+        bottom = h[r0+1, c0] + (h[r0+1, c0+1] - h[r0+1, c0]) * fc
+        height = top + (bottom - top) * fr
+
+        if ndim(height) == 0:
+            return float(height)
+        return height
+
+    @traced('landscape.makePyramid', 'load')
+    def makePyramid(self):
+        """ Build min/max mip pyramids over the heightmap cells. Level 0
+        holds the min/max height of every cell (the four pixels around a
+        quad); each level above covers 2x2 cells of the one below, up to
+        a single cell for the whole map. The cell grid is padded to a
+        power of two with cells that can never be hit. """
+
+        h = self.heights
+        cellMax = maximum(maximum(h[:-1, :-1], h[:-1, 1:]),
+                          maximum(h[1:, :-1], h[1:, 1:]))
+        cellMin = minimum(minimum(h[:-1, :-1], h[:-1, 1:]),
+                          minimum(h[1:, :-1], h[1:, 1:]))
+
+        cells = self.size - 1
+        side = 1
+        while side < cells:
+            side *= 2
+
+        top = full((side, side), -inf)
+        top[:cells, :cells] = cellMax
+        bottom = full((side, side), inf)
+        bottom[:cells, :cells] = cellMin
+
+        self.maxPyramid = [top]
+        self.minPyramid = [bottom]
+        while side > 1:
+            side //= 2
+            top = top.reshape(side, 2, side, 2).max(axis=(1, 3))
+            bottom = bottom.reshape(side, 2, side, 2).min(axis=(1, 3))
+            self.maxPyramid.append(top)
+            self.minPyramid.append(bottom)
+
+    def rayGrid(self, origins, directions, maxDist):
+        """ Convert rays to grid space: returns the start (col, row,
+        height), the per-unit-distance change in each, and the range of
+        distances [tStart, tEnd] for which each ray is over the map. """
+
+        o = asarray(origins, dtype=float64).reshape(-1, 3)
+        d = asarray(directions, dtype=float64).reshape(-1, 3)
+        d = d / ((d**2).sum(axis=1)**0.5)[:, newaxis]
+
+        start = stack(((o[:, 0] + RADIUS) / self.step,
+                       (RADIUS - o[:, 2]) / self.step,
+                       o[:, 1]), axis=1)
+        delta = stack((d[:, 0] / self.step, -d[:, 2] / self.step, d[:, 1]),
+                      axis=1)
+
+        # Clip each ray against the map's square in (col, row)
+        tStart = zeros(len(o))
+        tEnd = full(len(o), float(maxDist))
+        edge = self.size - 1
+        with errstate(divide='ignore', invalid='ignore'):
+            for axis in (0, 1):
+                p = start[:, axis]
+                dp = delta[:, axis]
+                t0 = (0 - p) / dp
+                t1 = (edge - p) / dp
+                still = dp == 0
+                outside = still & ((p < 0) | (p > edge))
+                tStart = where(still, tStart, maximum(tStart, minimum(t0, t1)))
+                tEnd = where(still, tEnd, minimum(tEnd, maximum(t0, t1)))
+                tEnd = where(outside, -inf, tEnd)
+        return start, delta, tStart, tEnd
+
+    def raycast(self, origins, directions, maxDist=FAR_CLIP):
+        """ Cast rays at the terrain. origins and directions are (x, y, z)
+        triples, or (N, 3) arrays for N rays at once. Returns the
+        distance along each ray to the first ground hit, or inf for rays
+        that miss within maxDist (a float for a single ray).
+
+        Walks down the min/max pyramid RAY_JUMP levels at a time, from the
+        single top cell: every candidate cell a ray crosses is split into
+        the cells it crosses further down (see splitCells), and those the
+        ray passes completely above, or only reaches after going under
+        another cell, are dropped. The candidates of all the rays are one
+        batch of numpy arrays, so a pass costs the same few dozen numpy
+        calls however many rays there are; cast many rays in one call
+        where you can. At level 0 the ray is intersected exactly with the
+        bilinear surface used by heightAt. """
+
+        start, delta, tStart, tEnd = self.rayGrid(origins, directions,
+                                                  maxDist)
+        hit = full(len(tStart), inf)
+
+        # The candidates: ray, the stretch [t0, t1] of it in the cell, and
+        # the cell's row and column at the current level
+        ray = arange(len(tStart))[tStart <= tEnd]
+        t0 = tStart[ray]
+        t1 = tEnd[ray]
+        row = zeros(len(ray), dtype=intp)
+        col = zeros(len(ray), dtype=intp)
+        level = len(self.maxPyramid) - 1
+        while True:
+            y0 = start[ray, 2] + delta[ray, 2] * t0
+            y1 = start[ray, 2] + delta[ray, 2] * t1
+            # A ray that goes right under a cell is in the ground by
+            # then, so nothing after that cell matters
+            under = full(len(tStart), inf)
+            below = maximum(y0, y1) < self.minPyramid[level][row, col]
+            minimum.at(under, ray[below], t0[below])
+            near = (minimum(y0, y1) <= self.maxPyramid[level][row, col]) & \
+                   (t0 <= under[ray])
+            ray, t0, t1, row, col, y0 = \
+                 ray[near], t0[near], t1[near], row[near], col[near], y0[near]
+            if level == 0 or not len(ray):
+                break
+            jump = min(RAY_JUMP, level)
+            level -= jump
+            ray, t0, t1, row, col = self.splitCells(level, jump, start, delta,
+                                                    ray, t0, t1, row, col)
+
+        if len(ray):
+            # Exact test against the bilinear patch in each leaf cell:
+            # height along the ray minus the surface is a quadratic in the
+            # distance s from t0.
+            h = self.heights
+            dp = delta[ray]
+            r0 = minimum(row, self.size - 2)
+            c0 = minimum(col, self.size - 2)
+            h00 = h[r0, c0]
+            A = h[r0, c0+1] - h00
+            B = h[r0+1, c0] - h00
+            C = h[r0+1, c0+1] - h00 - A - B
+            fa = start[ray, 0] + dp[:, 0] * t0 - c0
+            fb = start[ray, 1] + dp[:, 1] * t0 - r0
+            da = dp[:, 0]
+            db = dp[:, 1]
+
+            k0 = y0 - (h00 + A*fa + B*fb + C*fa*fb)
+            k1 = dp[:, 2] - (A*da + B*db + C*(fa*db + fb*da))
+            k2 = -C*da*db
+            sMax = t1 - t0
+            s = firstRoot(k0, k1, k2, sMax)
+            crossed = s <= sMax
+            minimum.at(hit, ray[crossed], t0[crossed] + s[crossed])
+
+        if ndim(origins) == 1:
+            return float(hit[0])
+        return hit
+
+    def splitCells(self, level, jump, start, delta, ray, t0, t1, row, col):
+        """ The cells at pyramid level level that the candidate stretches
+        of rays ([t0, t1] of ray ray, in cell row, col jump levels up)
+        pass through, as new candidates, in order along each ray. A
+        stretch crosses each of the lines between the smaller cells at
+        most once, so it splits into at most 2**(jump+1) - 1 cells. """
+
+        size = 2.0**level
+        lines = arange(1, 2**jump) # between the smaller cells, in each
+        t = [t0[:, newaxis]]
+        for axis, cell in ((0, col), (1, row)):
+            p = start[ray, axis, newaxis]
+            dp = delta[ray, axis, newaxis]
+            with errstate(divide='ignore', invalid='ignore'):
+                s = ((cell[:, newaxis] * 2**jump + lines) * size - p) / dp
+            # A line the stretch doesn't cross just splits off nothing at t1
+            t.append(where((s > t0[:, newaxis]) & (s < t1[:, newaxis]), s,
+                           t1[:, newaxis]))
+        t.append(t1[:, newaxis])
+        breaks = concatenate(t, axis=1)
+        breaks.sort(axis=1)
+        a = breaks[:, :-1]
+        b = breaks[:, 1:]
+        keep = b > a
+        keep[:, 0] = True # a stretch that is a single point stays one
+
+        # Each piece's cell is the one its middle is in (clipped to the
+        # big cell, against rounding)
+        pieces = keep.shape[1]
+        keep = keep.ravel()
+        ray = ray.repeat(pieces)[keep]
+        col = (col * 2**jump).repeat(pieces)[keep]
+        row = (row * 2**jump).repeat(pieces)[keep]
+        a = a.ravel()[keep]
+        b = b.ravel()[keep]
+        middle = 0.5 * (a + b)
+        col = clip(floor((start[ray, 0] + delta[ray, 0] * middle) / size),
+                   col, col + 2**jump - 1)
+        row = clip(floor((start[ray, 1] + delta[ray, 1] * middle) / size),
+                   row, row + 2**jump - 1)
+        return ray, a, b, row.astype(intp), col.astype(intp)
+
+    def raymarch(self, origins, directions, maxDist=FAR_CLIP, stride=0.25):
+        """ Brute-force version of raycast: steps every ray along in
+        increments of stride cells, sampling heightAt at each step. Only
+        useful as a reference for checking / benchmarking raycast. """
+
+        start, delta, t, tEnd = self.rayGrid(origins, directions, maxDist)
+        o = asarray(origins, dtype=float64).reshape(-1, 3)
+        d = asarray(directions, dtype=float64).reshape(-1, 3)
+        d = d / ((d**2).sum(axis=1)**0.5)[:, newaxis]
+
+        ds = stride * self.step
+        hit = full(len(o), inf)
+        active = t <= tEnd
+        prevT = None
+        prevGap = None
+        while active.any():
+            p = o + d * t[:, newaxis]
+            gap = p[:, 1] - self.heightAt(p[:, 0], p[:, 2])
+            down = active & (gap <= 0)
+            if prevT is None:
+                hit[down] = t[down]
+            else:
+                # Interpolate between this step and the last one
+                frac = prevGap[down] / (prevGap[down] - gap[down])
+                hit[down] = prevT[down] + (t[down] - prevT[down]) * frac
+            active &= ~down & (t < tEnd)
+            prevT = t
+            prevGap = gap
+            t = minimum(t + ds, tEnd)
+
+        if ndim(origins) == 1:
+            return float(hit[0])
+        return hit
+
     def getVerts(self):
-        """ Return the landscape vertices """
+        """ Return the landscape vertices, an (N, 3) float32 array """
         return self.verts
 
-        
-        
-        
+    def getIndices(self):
+        """ Return the triangle indices into getVerts(), a uint32 array """
+        return self.indices
 
+    def getTree(self):
+        """ Return the chunk quadtree """
+        return self.tree
+
+
+def firstRoot(k0, k1, k2, sMax):
+    """ For arrays of quadratics k0 + k1*s + k2*s^2, returns the smallest
+    s in [0, sMax] where each one is <= 0, or inf if there isn't one. """
+
+    with errstate(divide='ignore', invalid='ignore', over='ignore'):
+        disc = k1*k1 - 4.0*k2*k0
+        root = sqrt(maximum(disc, 0.0))
+        q = -0.5 * (k1 + where(k1 >= 0, root, -root))
+        # q/k2 and k0/q are the two roots (k0/q is the only one when k2
+        # is 0); NaNs and infs fall out in the range check.
+        s = full(len(k0), inf)
+        for r in (q / k2, k0 / q):
+            ok = (disc >= 0) & isfinite(r) & (r >= 0) & (r <= sMax)
+            s = where(ok, minimum(s, r), s)
+
+    # Below the surface from the start, or only crossing right at the end
+    s = where(k0 <= 0, 0.0, s)
+    end = k0 + k1*sMax + k2*sMax*sMax
+    return where(~isfinite(s) & (end <= 0), sMax, s)
 
-    
-            
-            
-            
-            
-            
-            
-                
-                
-        
\ No newline at end of file
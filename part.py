@@ -8,142 +8,251 @@
 #
 # Also implements the constraint class, a simple object that specifies
 # a part to constrain to and a distance.
+#
+# The parts and constraints don't store their own state: every part is a
+# row of the arrays in part.system (a particles object), and every
+# constraint a row of its constraint arrays. Steps use position based
+# dynamics (XPBD, with substeps): the parts move freely under their
+# forces, then the constraints are projected - all of them at once, as
+# numpy operations - and the velocities are whatever the projection
+# leaves. That keeps stiff constraints stable at 60 Hz, for airframes
+# with hundreds of parts.
+
+from weakref import WeakSet
+from numpy import zeros, array, arange, concatenate, flatnonzero, sqrt, \
+     maximum, newaxis
 
 from geometry import *
+from constants import TIMESTEP, EPSILON
+
+SUBSTEPS = 8 # constraint projections per step, see particles.step
+
+
+class particles:
+    # The state of a set of parts and the constraints between them, as
+    # arrays. Arrays grow (by doubling) as parts are added.
+
+    def __init__(s, capacity=16):
+        """ Make an empty set, with room for capacity parts and
+        constraints before the arrays have to grow """
+        s.n = 0 # parts
+        s.P = zeros((capacity, 3)) # positions
+        s.V = zeros((capacity, 3)) # velocities
+        s.W = zeros(capacity) # inverse masses, 0 for fixed parts
+        s.F = zeros((capacity, 3)) # forces this step
+
+        s.m = 0 # constraints
+        s.i = zeros(capacity, dtype=int) # the part each one moves...
+        s.j = zeros(capacity, dtype=int) # ...toward or away from this one
+        s.rest = zeros(capacity) # lengths
+        s.compliance = zeros(capacity) # inverse stiffness, 0 for rigid
+        s.pairs = {} # (lower part row, higher part row) -> constraint row
+        s.batches = [] # constraint rows, see colorConstraints
+        s.colored = 0 # how many constraints the batches cover
+
+    def addPart(s, pos, vel, mass):
+        """ Add a part at point pos, with velocity vector vel and mass
+        mass (None or 0 for a part that never moves). Returns its row. """
+
+        if s.n == len(s.W):
+            s.P, s.V, s.W, s.F = [grow(a) for a in (s.P, s.V, s.W, s.F)]
+        k = s.n
+        s.P[k] = pos.components()
+        s.V[k] = vel.components()
+        s.W[k] = 1.0 / mass if mass else 0.0
+        s.n += 1
+        return k
+
+    def addConstraint(s, i, j, l, compliance=0.0):
+        """ Keep parts i and j at distance l. A constraint between the
+        same two parts already there is reused (the old spring
+        constraints needed one each way), but only if it has the same l
+        and compliance: a different one raises ValueError.
+        compliance is how much it gives (distance per unit force), 0 for
+        a rigid one. Returns its row. """
+
+        pair = (i, j) if i < j else (j, i)
+        if pair in s.pairs:
+            k = s.pairs[pair] # the same constraint, the other way
+            if abs(s.rest[k] - l) > 1e-9 * abs(l) or \
+               s.compliance[k] != compliance:
+                raise ValueError("parts %d and %d are already constrained "
+                                 "to distance %g, compliance %g" %
+                                 (i, j, s.rest[k], s.compliance[k]))
+            return k
+        if s.m == len(s.rest):
+            s.i, s.j, s.rest, s.compliance = \
+                 [grow(a) for a in (s.i, s.j, s.rest, s.compliance)]
+        k = s.m
+        s.i[k] = i
+        s.j[k] = j
+        s.rest[k] = l
+        s.compliance[k] = compliance
+        s.m += 1
+        s.pairs[pair] = k
+        return k
+
+    def colorConstraints(s):
+        """ Split the constraints into batches in which no two share a
+        part (a greedy edge coloring), so a whole batch can be projected
+        at once, and the batches one after the other (Gauss-Seidel). """
+
+        used = [set() for k in range(s.n)] # batches each part is in
+        color = []
+        for i, j in zip(s.i[:s.m].tolist(), s.j[:s.m].tolist()):
+            c = 0
+            while c in used[i] or c in used[j]:
+                c += 1
+            used[i].add(c)
+            used[j].add(c)
+            color.append(c)
+        color = array(color, dtype=int)
+        s.batches = [flatnonzero(color == c) for c in range(color.max() + 1)] \
+                    if s.m else []
+        s.colored = s.m
+
+    def step(s, dt=TIMESTEP, substeps=SUBSTEPS):
+        """ Advance every part dt seconds, under the forces in s.F. Each
+        of the substeps moves the parts, projects every constraint once
+        and updates the velocities from how far the parts really went. """
+
+        if s.colored != s.m:
+            s.colorConstraints()
+        n = s.n
+        P, V, W = s.P[:n], s.V[:n], s.W[:n]
+        h = dt / substeps
+        a = s.F[:n] * W[:, newaxis] # acceleration
+
+        # XPBD: a constraint moves its parts by their share of the error,
+        # w / (w_i + w_j + compliance/h^2), the lighter one further.
+        # Both parts of a batch are moved with one indexed add, of
+        # share * (P_j - P_i) * (1 - l/length): + for i, - for j.
+        batches = []
+        for b in s.batches:
+            i, j = s.i[b], s.j[b]
+            wi, wj = W[i], W[j]
+            total = wi + wj + s.compliance[b] / (h * h)
+            total[total == 0.0] = 1.0 # both fixed
+            share = concatenate((wi / total, -wj / total))[:, newaxis]
+            twice = concatenate((arange(len(b)), arange(len(b))))
+            batches.append((i, j, concatenate((i, j)), s.rest[b], share,
+                            twice))
+
+        for k in range(substeps):
+            start = P.copy()
+            V += a * h
+            P += V * h
+
+            for i, j, ij, rest, share, twice in batches:
+                d = P[j] - P[i]
+                length = sqrt((d * d).sum(axis=1))
+                d *= (1.0 - rest / maximum(length, EPSILON))[:, newaxis]
+                P[ij] += share * d[twice]
+
+            V[:] = P - start
+            V /= h
+
+
+def grow(a):
+    """ a copied into an array twice as long """
+    bigger = zeros((2 * len(a),) + a.shape[1:], dtype=a.dtype)
+    bigger[:len(a)] = a
+    return bigger
 
 
 class part:
 
-    instances = []
+    instances = WeakSet() # so parts nothing else holds can go
+    system = particles() # where every part's state lives
 
     def __init__(s, pos, vel, mass):
         """ Initialize the part """
 
-        s.pos = pos # the part's location point
-        s.vel = vel
+        s.index = part.system.addPart(pos, vel, mass) # its row
         s.mass = mass
-        s.acc = vector(0.0, 0.0, 0.0) # the current acceleration
         s.forces = [] # list of forces acting on the part
         # Each force is a FUNCION.
         s.constraints = [] # List of constraint objects. Each constrait
         # is another part and a distance.
 
-        part.instances.append(s)
+        part.instances.add(s)
+
+    # The part's location point and velocity, views of its row (so
+    # changing them moves the part). Setting them copies the values.
+    @property
+    def pos(s):
+        return arrayPoint(part.system.P[s.index])
+
+    @pos.setter
+    def pos(s, p):
+        part.system.P[s.index] = p.components()
+
+    @property
+    def vel(s):
+        return arrayVector(part.system.V[s.index])
 
+    @vel.setter
+    def vel(s, v):
+        part.system.V[s.index] = v.components()
 
+    @property
+    def acc(s):
+        """ The acceleration from the forces of the last step """
+        a = part.system.F[s.index] * part.system.W[s.index]
+        return vector(*a.tolist())
 
     @classmethod
-    def update(cls):
+    def update(cls, dt=TIMESTEP):
         """ Update the positions, velocities, etc for each part """
-        
+
+        system = cls.system
+        system.F[:] = 0.0
         for c in cls.instances:
-            c.computeAcc()
-            c.updateVelocity()
-            c.updatePosition()
-    
-    def computeAcc(s):
-        """ Compute the acceleration of the plane at this timestep
-        based on the forces acting on it. Forces are assumed to be
-        in lbf. """
-
-        massinverse = 1/s.mass
-        fv = vector(0.0, 0.0, 0.0) # Force vector
-        
-        for f in s.forces:
-            fv += f().scale(massinverse)
-        for c in s.constraints:
-            fv += c.force()
-
-            
-        s.acc = fv
-
-
-    def updateVelocity(s):
-        """ Compute the velocity vector of the plane, based
-        on acceleration this frame. Uses RK4"""
-
-        k1 = s.acc.scale(1/60)
-        yn = s.vel
-        
-        # Now, update velocity with k1, and recompute acceleration
-        s.vel += k1.scale(1/2) # This velocity will be discarded
-        s.computeAcc()
-        k2 = s.acc.scale(1/60)
-
-        s.vel = yn + k2.scale(1/2)
-        s.computeAcc()
-        k3 = s.acc.scale(1/60)
-
-        # Finally, get k4:
-        s.vel = yn + k3
-        s.computeAcc()
-        k4 = s.acc.scale(1/60)
-
-        # Compute final acceleration value
-        s.vel = yn + k1.scale(1/6) + k2.scale(1/3) \
-                + k3.scale(1/3) + k4.scale(1/6)
-        
-
-                        
-
-        
-        
-        
-
-    def updatePosition(s):
-        """ Compute the updated position of the plane, based on velocity
-        this frame. Uses RK4 """
-        
-        k1 = s.vel.scale(1/60)
-        yn = s.pos
-
-        s.pos += k1.scale(1/2)
-        s.updateVelocity()
-        k2 = s.vel.scale(1/60)
-
-        s.pos = yn + k2.scale(1/2)
-        s.updateVelocity()
-        k3 = s.vel.scale(1/60)
-
-        s.pos = yn + k3
-        s.updateVelocity()
-        k4 = s.vel.scale(1/60)
-
-        s.pos = yn + k1.scale(1/6) + k2.scale(1/3) \
-                + k3.scale(1/3) + k4.scale(1/6)
-    
+            c.computeForce()
+        system.step(dt)
+
+    def computeForce(s):
+        """ Add up the forces acting on the part, into its row of
+        part.system.F. Forces are assumed to be in lbf. """
+
+        if s.forces:
+            f = part.system.F[s.index]
+            for function in s.forces:
+                f += function().components()
+
+    def constrain(s, other, l, compliance=0.0):
+        """ Keep this part at distance l from part other (see
+        constraint). Returns the constraint. """
+        c = constraint(s, other, l, compliance)
+        s.constraints.append(c)
+        return c
+
     def minus(s, other):
         """ Return the vector result of substracting two part positions. """
         return s.pos.minus(other.pos)
 
 
     __sub__ = minus
-    
+
 
 class constraint:
     # Constraints are ridgid connections between two parts, of some length.
-    # Constraints are one-directional (i.e. you should have one going
-    # in each direction).
-    # A constrait is modeled as a very stiff spring between objects.
-
-    def __init__(s, this, other, l):
+    # They're projected by part.system: each substep, both parts are moved
+    # back to l apart, the lighter one further. With compliance > 0 it
+    # acts like a spring instead. Constraints used to be one-directional
+    # (one going in each direction); adding both still works, the second
+    # just shares the first one's row (so it has to have the same l and
+    # compliance).
+
+    def __init__(s, this, other, l, compliance=0.0):
         """ Create a constrait between part 'this' and another
         part 'other', forcing them to maintaing distance l. """
         s.other = other
         s.this = this
         s.l = l
+        s.index = part.system.addConstraint(this.index, other.index, l,
+                                            compliance)
 
-    def force(s):
-        """ Generates the force of this constraint """
-
-        v = s.other.pos - s.this.pos
-        lv = v.norm() # actual distance between the objects
-        
-        diff = lv - s.l
-        return v.unit().scale(diff/5) # this is the force to apply
-        # to "this". It's actually not very large (because constraints don't
-        # take mass into account)
-        
-     
-
-    
\ No newline at end of file
+    def error(s):
+        """ How far the parts are from distance l right now """
+        return (s.other.pos - s.this.pos).norm() - s.l
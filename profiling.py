@@ -0,0 +1,250 @@
+# profiling.py
+#
+# Per-frame phase timers. pyflight.py splits each frame into phases -
+# physics, HUD update, terrain, HUD drawing, ... - and times each one with
+# lap():
+#
+#   t = timers.start()
+#   plane.fly()
+#   t = timers.lap(PHYSICS, t)
+#   phud.update()
+#   t = timers.lap(HUD_UPDATE, t)
+#   ...
+#   timers.endFrame()
+#
+# Each phase's time for the last FRAME_HISTORY frames is kept in a ring
+# buffer (one row per phase), so nothing is allocated while timing. The
+# HUD draws them as a stacked frame time graph with the median and 99th
+# percentile of each phase (see hud.getFrameGraph).
+#
+# The timers start switched off. Then start() and lap() return at once
+# and endFrame() does nothing: a few hundred nanoseconds a frame, far
+# under 1% of a 17 ms frame.
+#
+# A capture profiles the next few frames of a running sim (pyflight.py
+# starts one with the p key), so the profile isn't swamped by the terrain
+# loading at startup. It runs cProfile, and at the same time samples the
+# main thread's Python stack every PROFILE_INTERVAL seconds of CPU time,
+# from a SIGPROF timer. (Where there is no setitimer, e.g. on Windows,
+# another thread samples it instead. That's biased toward the places the
+# main thread lets go of the GIL, so take those stacks with a pinch of
+# salt.) When the frames are done it writes
+#
+#   <file>-<n>.prof       the cProfile stats, for pstats or snakeviz
+#   <file>-<n>.txt        the same, sorted by cumulative and by own time
+#   <file>-<n>.collapsed  the sampled stacks, one "a;b;c count" line per
+#                         stack, for flamegraph.pl or speedscope
+
+import sys
+import signal
+import cProfile
+import pstats
+from collections import Counter
+from os.path import basename
+from threading import Thread, Event, get_ident
+from time import perf_counter
+from numpy import zeros, array, percentile, cumsum, arange, concatenate, \
+     float32, newaxis
+
+from constants import PROFILE_FRAMES, PROFILE_FILE, PROFILE_INTERVAL
+
+FRAME_HISTORY = 240 # frames kept, 4 seconds at 60 fps
+
+# The phases pyflight.py times, in the order they're drawn in the graph
+PHYSICS, HUD_UPDATE, TERRAIN, HUD_LINES, HUD_TEXT, SWAP, GRAPH = range(7)
+PHASES = ('physics', 'hud update', 'terrain', 'hud lines', 'hud text',
+          'swap', 'graph')
+
+# The graph color of each phase
+COLORS = ((1.0, 0.3, 0.3), (1.0, 0.8, 0.2), (0.8, 0.4, 1.0),
+          (0.2, 1.0, 0.2), (0.3, 0.9, 1.0), (0.6, 0.6, 0.6),
+          (1.0, 1.0, 1.0))
+
+
+class timers:
+    # Time spent in each phase of the last few frames.
+
+    def __init__(s, phases=PHASES, frames=FRAME_HISTORY):
+        """ Make timers (switched off) for the named phases, keeping
+        frames frames """
+        s.enabled = False
+        s.phases = phases
+        s.times = zeros((len(phases), frames)) # seconds, ring buffer
+        s.current = zeros(len(phases)) # this frame so far
+        s.frames = 0 # frames recorded, ever
+
+    def toggle(s):
+        """ Switch the timers on or off. Switching on starts a new
+        history. """
+        s.enabled = not s.enabled
+        s.times[:] = 0.0
+        s.current[:] = 0.0
+        s.frames = 0
+
+    def start(s):
+        """ The time to pass to the first lap() """
+        return perf_counter() if s.enabled else 0.0
+
+    def lap(s, phase, started):
+        """ Add the time since started (from start() or the last lap()) to
+        phase number phase. Returns the time now, for the next lap. """
+        if not s.enabled:
+            return 0.0
+        now = perf_counter()
+        s.current[phase] += now - started
+        return now
+
+    def endFrame(s):
+        """ Store this frame's times and start the next frame """
+        if not s.enabled:
+            return
+        s.times[:, s.frames % s.times.shape[1]] = s.current
+        s.current[:] = 0.0
+        s.frames += 1
+
+    def history(s):
+        """ The recorded frames, oldest first: an array of one row per
+        phase, in seconds """
+        n = s.times.shape[1]
+        if s.frames < n:
+            return s.times[:, :s.frames]
+        k = s.frames % n
+        return concatenate((s.times[:, k:], s.times[:, :k]), axis=1)
+
+    def percentiles(s, q=(50, 99)):
+        """ The q-th percentiles of each phase's time, and of the whole
+        frame, in seconds: an array of one row per phase plus one for
+        the frame, one column per percentile """
+        h = s.history()
+        if h.shape[1] == 0:
+            return zeros((len(s.phases) + 1, len(q)))
+        h = concatenate((h, h.sum(axis=0)[newaxis]))
+        return percentile(h, q, axis=1).T
+
+    def graph(s, left, bottom, width, height, scale):
+        """ Vertices and colors for a stacked bar graph of the history,
+        one vertical line per frame per phase, as float32 arrays for
+        GL_LINES with 2-D vertices. The graph fills width by height
+        pixels from (left, bottom), y growing downward (as glOrtho is set
+        up for the HUD text); scale seconds is the full height. """
+
+        h = s.history()
+        phases, n = h.shape
+        x = left + (arange(n) + 0.5) * (width / s.times.shape[1])
+        top = bottom - cumsum(h, axis=0) * (height / scale) # (phases, n)
+        base = concatenate((zeros((1, n)) + bottom, top[:-1]))
+
+        verts = zeros((phases, n, 2, 2), dtype=float32)
+        verts[:, :, 0, 0] = x
+        verts[:, :, 1, 0] = x
+        verts[:, :, 0, 1] = base.clip(bottom - height, None)
+        verts[:, :, 1, 1] = top.clip(bottom - height, None)
+        colors = zeros((phases, n, 2, 3), dtype=float32)
+        colors[:] = array(COLORS, dtype=float32)[:phases, newaxis, newaxis]
+        return verts.reshape(-1, 2), colors.reshape(-1, 3)
+
+
+class capture:
+    # Profiles the next few frames: cProfile stats and sampled stacks.
+
+    def __init__(s, frames=PROFILE_FRAMES, path=PROFILE_FILE,
+                 interval=PROFILE_INTERVAL):
+        """ Make a capture (not running) of frames frames, written to
+        files starting with path, sampling stacks every interval
+        seconds """
+        s.frames = frames
+        s.path = path
+        s.interval = interval
+        s.running = False
+        s.remaining = 0 # frames left to profile
+        s.captures = 0 # captures written, for the file names
+        s.profile = None
+        s.stacks = Counter() # collapsed stack -> samples
+        s.timer = hasattr(signal, 'setitimer') # sample with SIGPROF
+        s.handler = None # the SIGPROF handler before the capture
+        s.done = Event() # or with a thread, stopped by this
+        s.sampler = None
+        s.switch = None # the thread switch interval before the capture
+
+    def start(s):
+        """ Start profiling, until frames more frames have ended. Call
+        it from the thread to profile (the main one). """
+        if s.running:
+            return
+        s.running = True
+        s.remaining = s.frames
+        s.stacks = Counter()
+        if s.timer:
+            s.handler = signal.signal(signal.SIGPROF, s.interrupt)
+            signal.setitimer(signal.ITIMER_PROF, s.interval, s.interval)
+        else:
+            s.done.clear()
+            s.sampler = Thread(target=s.sample,
+                               args=(get_ident(),), daemon=True)
+            s.switch = sys.getswitchinterval()
+            sys.setswitchinterval(s.interval) # so the sampler gets a look in
+            s.sampler.start()
+        s.profile = cProfile.Profile()
+        s.profile.enable()
+
+    def endFrame(s):
+        """ Call at the end of every frame. Returns the names of the
+        files written, once the last frame is done, or None. """
+        if not s.running:
+            return None
+        s.remaining -= 1
+        if s.remaining > 0:
+            return None
+        return s.stop()
+
+    def stop(s):
+        """ Stop profiling now and write the files. Returns their
+        names. """
+
+        s.profile.disable()
+        if s.timer:
+            signal.setitimer(signal.ITIMER_PROF, 0.0)
+            signal.signal(signal.SIGPROF, s.handler)
+        else:
+            s.done.set()
+            s.sampler.join()
+            sys.setswitchinterval(s.switch)
+        s.running = False
+
+        s.captures += 1
+        name = "%s-%d" % (s.path, s.captures)
+        s.profile.dump_stats(name + '.prof')
+        with open(name + '.txt', 'w') as f:
+            stats = pstats.Stats(s.profile, stream=f)
+            stats.strip_dirs()
+            f.write("%d frames\n\nBy cumulative time:\n" % s.frames)
+            stats.sort_stats('cumulative').print_stats(40)
+            f.write("By own time:\n")
+            stats.sort_stats('tottime').print_stats(40)
+        with open(name + '.collapsed', 'w') as f:
+            for stack, count in sorted(s.stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+        return [name + '.prof', name + '.txt', name + '.collapsed']
+
+    def record(s, frame):
+        """ Count the stack of frame, collapsed: outermost function
+        first, separated by semicolons """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s:%d)" % (code.co_name,
+                                         basename(code.co_filename),
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        if stack:
+            s.stacks[';'.join(reversed(stack))] += 1
+
+    def interrupt(s, signum, frame):
+        """ The SIGPROF handler: sample the interrupted stack """
+        s.record(frame)
+
+    def sample(s, thread):
+        """ Sample thread's stack every s.interval seconds until s.done
+        is set (runs in the sampler thread) """
+        while not s.done.wait(s.interval):
+            s.record(sys._current_frames().get(thread))
@@ -32,10 +32,16 @@ from geometry import point, vector, ORIGIN
 from quat import quat
 from controls import *
 from landscape import *
+from quadtree import frustum
 
 from constants import *
 from airplane import *
 from hud import *
+from engine import scheduler
+from replay import replay
+from recorder import recorder
+from profiling import *
+from tracing import tracer, traced
 from time import *
 
 
@@ -51,15 +57,26 @@ yStart = 0
 trackball = quat.for_rotation(0.0,vector(1.0,0.0,0.0))
 land = None
 vertex_buffer = None
+index_buffer = None
 horizone_vertex_buffer = None
 vertices = []
+terrain = None # the landscape's chunk quadtree
 
 forward = 0.0
 right = 0.0
 up = 0.0
 
 plane = airplane()
-phud = hud(plane) # player's HUD
+frameTimers = timers() # time spent in each phase of a frame, see profiling.py
+phud = hud(plane, frameTimers) # player's HUD
+frameProfile = capture() # profiles a few frames on demand, see profiling.py
+
+frameClock = scheduler() # decides how many physics steps to run per frame
+
+flight = None # the replay being recorded or played back, if any
+flightPath = None # where it's saved / loaded from
+replaying = False # True to fly the recorded inputs instead of the mouse's
+traceFile = TRACE_FILE # where the trace goes, see tracing.py
 
 mouse_x = 0.0
 mouse_y = 0.0
@@ -68,11 +85,15 @@ rudder = 0.0
 
 # Main draw function
 
+@traced('draw', 'draw')
 def draw():
     """ draw the scene """
-    global land, vertices, vertex_buffer, forward, right, up, height, width
+    global land, vertices, terrain, vertex_buffer, index_buffer
+    global forward, right, up, height, width
     
     
+    t = frameTimers.start()
+
     # Clear the rendering information.
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)    
 
@@ -85,22 +106,32 @@ def draw():
     #s = 1
     #glScalef(s, s, s)
     # Get the plane's position to set view
-    Pilot, Nose, Up = plane.getViewpoint()
+    Pilot, Nose, Up = plane.getViewpoint(frameClock.alpha())
     horizon_verts = phud.getHorizon()
     fpm_verts = phud.getFPM()
     gluLookAt(Pilot.x, Pilot.y, Pilot.z, Nose.x, Nose.y, Nose.z, Up.dx, Up.dy, Up.dz)
     # Load VBOs
-    #glBindBuffer(GL_ARRAY_BUFFER, vertices)
+    glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
     glVertexPointer(3, GL_FLOAT, 0, None)
     glPolygonMode( GL_FRONT_AND_BACK, GL_LINE ) # wireframe mode
     
-    # Draw the terrain
+    # Draw the terrain chunks that are in view, each at a level of
+    # detail picked by its distance from the pilot.
+    view = frustum.fromGL(glGetFloatv(GL_MODELVIEW_MATRIX),
+                          glGetFloatv(GL_PROJECTION_MATRIX))
     glColor3f(0.8, 0.4, 1.0)
     glLineWidth(1.0)
-    glDrawArrays(GL_TRIANGLES, 0, len(vertices))
+    for offset, count in terrain.select(view, Pilot):
+        glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT, offset)
     glDisableVertexAttribArray(0)
+    t = frameTimers.lap(TERRAIN, t)
     
-    # Now, draw the HUD:
+    # Now, draw the HUD. It is positioned around the latest physics
+    # state, so move it along with the interpolated viewpoint:
+    glPushMatrix()
+    offset = Pilot - plane.Pilot
+    glTranslatef(offset.dx, offset.dy, offset.dz)
     glLineWidth(3.0)
     glBegin(GL_LINES)
     glColor3f(0.0, 1.0, 0.0)
@@ -112,6 +143,8 @@ def draw():
                    
     glEnd()
     glPopMatrix()
+    glPopMatrix()
+    t = frameTimers.lap(HUD_LINES, t)
 
     # Draw the text parts of the HUD:
     glPushMatrix()
@@ -154,27 +187,75 @@ def draw():
     glutBitmapString(GLUT_BITMAP_9_BY_15, phud.getDebug1())
     glRasterPos(width*(1/6), height*(8/12), 1.0)
     glutBitmapString(GLUT_BITMAP_9_BY_15, phud.getDebug2())
+    t = frameTimers.lap(HUD_TEXT, t)
 
+    if phud.showGraph:
+        drawFrameGraph()
+        t = frameTimers.lap(GRAPH, t)
         
     glMatrixMode(GL_PROJECTION)
     glPopMatrix()
     glMatrixMode(GL_MODELVIEW)
     glPopMatrix()
 
+    swap = tracer.begin()
     glFlush()
     
     glutSwapBuffers()
+    tracer.end('swap', swap, 'draw')
+    frameTimers.lap(SWAP, t)
+    frameTimers.endFrame()
+    files = frameProfile.endFrame()
+    if files:
+        print("Profile written to " + ", ".join(files))
+
+
+def drawFrameGraph():
+    """ Draw the frame time graph, and the p50 / p99 time of each
+    phase above it (see hud.getFrameGraph). Call with the HUD text's
+    projection set up. """
+
+    verts, colors = phud.getFrameGraph(width, height)
+    glBindBuffer(GL_ARRAY_BUFFER, 0) # the arrays are in memory
+    glEnableClientState(GL_COLOR_ARRAY)
+    glVertexPointer(2, GL_FLOAT, 0, verts)
+    glColorPointer(3, GL_FLOAT, 0, colors)
+    glLineWidth(1.0)
+    glDrawArrays(GL_LINES, 0, len(verts))
+    glDisableClientState(GL_COLOR_ARRAY)
+
+    stats = phud.getFrameStats()
+    top = height * 0.8 - 10 - 13 * len(stats)
+    for i, (color, text) in enumerate(stats):
+        glColor3f(*color)
+        glRasterPos(10, top + 13 * (i + 1), 1.0)
+        glutBitmapString(GLUT_BITMAP_8_BY_13, text)
 
+
+@traced('timer', 'frame')
 def timer(val):
-    """ Pauses the scene and renders at 60 fps if possible """
+    """ Pauses the scene and renders at 60 fps if possible. Physics runs
+    in fixed TIMESTEP steps, as many as the real time since the last
+    frame calls for. """
     global rudder
     
     glutPostRedisplay()
     # update the plane's position and get it
     plane.inputStick(mouse_x, mouse_y)
     plane.inputRudder(rudder)
-    plane.fly()
+    t = frameTimers.start()
+    steps = frameClock.tick()
+    tracer.counter('physics steps', steps, 'frame')
+    for i in range(steps):
+        if replaying:
+            flight.step(plane)
+        else:
+            if flight is not None:
+                flight.record(plane)
+            plane.fly()
+    t = frameTimers.lap(PHYSICS, t)
     phud.update()
+    frameTimers.lap(HUD_UPDATE, t)
     glutTimerFunc(MS_PER_FRAME, timer, 0)
     
 
@@ -191,7 +272,7 @@ def resize(w, h):
     scale = 2.0 * r/w
     glMatrixMode(GL_PROJECTION)
     glLoadIdentity()
-    gluPerspective(60, width/height, 0.001,  2500.0)
+    gluPerspective(FIELD_OF_VIEW, width/height, NEAR_CLIP, FAR_CLIP)
     glMatrixMode(GL_MODELVIEW)
     glLoadIdentity()
 
@@ -245,6 +326,12 @@ def keyboard(key, x, y):
     # Handle ESC key.
     if key == b'\033':	
         # "\033" is the Escape key
+        if flight is not None and not replaying:
+            flight.save(flightPath)
+        if tracer.enabled:
+            tracer.dump(traceFile)
+        if plane.recorder is not None:
+            plane.recorder.close()
         sys.exit(1)
 
     if key == b'w':
@@ -264,6 +351,31 @@ def keyboard(key, x, y):
     if key == b'd':
         rudder = 0.5
 
+    if key == b'g':
+        phud.toggleGraph() # the frame time graph
+
+    if key == b'p':
+        # Profile the next PROFILE_FRAMES frames
+        if not frameProfile.running:
+            print("Profiling %d frames" % frameProfile.frames)
+            frameProfile.start()
+
+    if key == b't':
+        # Start tracing, or stop and write the trace out
+        if tracer.enabled:
+            tracer.stop()
+            print("Wrote %d trace events to %s"
+                  % (tracer.dump(traceFile), traceFile))
+        else:
+            tracer.clear()
+            tracer.start()
+
+    # Seek 10 s back / forward in a replay
+    if replaying and key in (b'[', b']'):
+        seconds = -10.0 if key == b'[' else 10.0
+        flight.seekTime(plane, flight.time() + seconds)
+        phud.update()
+
         
 def release(key, x, y):
     """ Handles releasing a key """
@@ -279,9 +391,11 @@ def release(key, x, y):
 def init():
     """ Initializes objects used in the scene. """
     global land, vertex_buffer, vertices, vertex_buffer, horizon_vertex_buffer
+    global index_buffer, terrain
 
     land = landscape('landscapes/16i__stonehenge.raw')
     vertices = land.getVerts()
+    terrain = land.getTree()
     #vertices = [0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0]
 
     # Add landscape to vertex buffer
@@ -290,21 +404,45 @@ def init():
 
 
     vertex_buffer = glGenBuffers(1)
+    index_buffer = glGenBuffers(1)
     horizon_vertex_buffer = glGenBuffers(1)
     
+    # The numpy arrays are handed to GL directly, no copy is made.
     glBindBuffer (GL_ARRAY_BUFFER, vertex_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(vertices)*4, 
-                  (c_float*len(vertices))(*vertices), GL_STATIC_DRAW)
+    glBufferData (GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+    glBindBuffer (GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+    glBufferData (GL_ELEMENT_ARRAY_BUFFER, terrain.indices.nbytes,
+                  terrain.indices, GL_STATIC_DRAW)
 
 
 
     
 def main(argc, argv):
-    """ Sets up GL and GLUT """
-    global width, height
+    """ Sets up GL and GLUT. "pyflight.py record <file>" records the
+    flight to file, "pyflight.py replay <file>" plays one back (see
+    replay.py), and "trace <file>" (with either, or alone) traces the
+    whole session to file (see tracing.py). """
+    global width, height, flight, flightPath, replaying, traceFile
+
+    options = dict(zip(argv[1::2], argv[2::2])) # word -> file
+    if 'trace' in options:
+        traceFile = options['trace']
+        tracer.start()
+    if 'record' in options:
+        flight = replay()
+        flightPath = options['record']
+    elif 'replay' in options:
+        flightPath = options['replay']
+        flight = replay.open(flightPath)
+        try:
+            flight.seek(plane, 0)
+        except ValueError as e:
+            sys.exit("Can't replay %s: %s" % (flightPath, e))
+        replaying = True
+    if RECORDER and not replaying:
+        plane.recorder = recorder(RECORDER, RECORDER_CAPACITY)
 
     # initialize the window
-    clock()
     glutInit(argv)
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
     glutInitWindowPosition(0, 20)
@@ -0,0 +1,224 @@
+# quadtree.py
+#
+# Splits a landscape into square chunks and organizes them in a quadtree,
+# so the terrain can be drawn with level of detail (LOD) and view frustum
+# culling.
+#
+# Every chunk shares the landscape's vertex grid; the chunks only differ
+# in which vertices their triangles use. Each chunk gets LOD_LEVELS index
+# lists, level k using every 2^k'th vertex, all packed into one uint32
+# index buffer. Drawing a chunk is a single glDrawElements call on its
+# slice of that buffer, picked by distance from the viewpoint.
+#
+# Chunk edges always include their last row/column, so neighboring chunks
+# line up, but neighbors drawn at different levels can show small cracks
+# in filled (non-wireframe) mode.
+
+from ctypes import c_void_p
+from math import log2, tan, pi
+from numpy import arange, array, concatenate, cross, dot, stack, \
+     float64, uint32, newaxis
+
+from constants import *
+
+CHUNK_QUADS = 32 # quads per chunk side at full detail
+LOD_LEVELS = 4 # levels of detail per chunk, each with half the vertices
+LOD_DISTANCE = 300.0 # chunks closer than this are drawn at full detail;
+# every doubling of the distance after that drops one level.
+
+
+class frustum:
+    # The six clipping planes of a view volume. Each plane is stored as
+    # (a, b, c, d), with a*x + b*y + c*z + d >= 0 for points inside.
+
+    def __init__(s, clip):
+        """ Build the frustum from a 4x4 (row major) clip matrix,
+        i.e. projection * modelview. """
+
+        c = array(clip, dtype=float64)
+        planes = array([c[3] + c[0], c[3] - c[0], # left, right
+                        c[3] + c[1], c[3] - c[1], # bottom, top
+                        c[3] + c[2], c[3] - c[2]]) # near, far
+        planes /= ((planes[:, :3]**2).sum(axis=1)**0.5)[:, newaxis]
+        s.planes = planes
+
+    @classmethod
+    def fromGL(cls, modelview, projection):
+        """ Build the frustum from matrices returned by glGetFloatv, which
+        are column major. """
+        return cls(dot(modelview, projection).T)
+
+    @classmethod
+    def fromView(cls, eye, at, up, fovy, aspect, near, far):
+        """ Build the frustum for a gluLookAt / gluPerspective style view.
+        eye and at are points, up is a vector, fovy is in degrees. """
+
+        e = array(eye.components(), dtype=float64)
+        f = array(at.components(), dtype=float64) - e
+        f /= dot(f, f)**0.5
+        side = cross(f, array(up.components(), dtype=float64))
+        side /= dot(side, side)**0.5
+        u = cross(side, f)
+
+        view = array([[side[0], side[1], side[2], -dot(side, e)],
+                      [u[0], u[1], u[2], -dot(u, e)],
+                      [-f[0], -f[1], -f[2], dot(f, e)],
+                      [0.0, 0.0, 0.0, 1.0]])
+
+        cot = 1.0 / tan(fovy * pi / 360.0)
+        proj = array([[cot / aspect, 0.0, 0.0, 0.0],
+                      [0.0, cot, 0.0, 0.0],
+                      [0.0, 0.0, (far + near) / (near - far),
+                       2.0 * far * near / (near - far)],
+                      [0.0, 0.0, -1.0, 0.0]])
+        return cls(dot(proj, view))
+
+    def classify(s, lo, hi):
+        """ Test the axis aligned box with corners lo and hi (sequences
+        of x, y, z). Returns -1 if it is completely outside, 1 if it is
+        completely inside, and 0 if it straddles the frustum. """
+
+        inside = 1
+        for a, b, c, d in s.planes:
+            # The box corner furthest along the plane normal, and the
+            # one furthest against it:
+            far = a*(hi[0] if a > 0 else lo[0]) + \
+                  b*(hi[1] if b > 0 else lo[1]) + \
+                  c*(hi[2] if c > 0 else lo[2]) + d
+            if far < 0:
+                return -1
+            near = a*(lo[0] if a > 0 else hi[0]) + \
+                   b*(lo[1] if b > 0 else hi[1]) + \
+                   c*(lo[2] if c > 0 else hi[2]) + d
+            if near < 0:
+                inside = 0
+        return inside
+
+
+class chunk:
+    # A square block of terrain, with one index list per level of detail.
+
+    def __init__(s, lo, hi, lods):
+        """ Create a chunk with bounding box corners lo and hi, and lods,
+        a list of (byte offset, index count) into the shared index buffer,
+        most detailed first. """
+        s.lo = lo
+        s.hi = hi
+        s.lods = [(c_void_p(offset), count) for offset, count in lods]
+
+    def distance(s, eye):
+        """ Distance from point eye to the closest point of the chunk """
+        d2 = 0.0
+        for e, lo, hi in zip(eye.components(), s.lo, s.hi):
+            if e < lo:
+                d2 += (lo - e)**2
+            elif e > hi:
+                d2 += (e - hi)**2
+        return d2**0.5
+
+    def level(s, eye):
+        """ Pick the level of detail to draw this chunk with """
+        d = s.distance(eye)
+        if d < LOD_DISTANCE:
+            return 0
+        return min(len(s.lods) - 1, int(log2(d / LOD_DISTANCE)) + 1)
+
+
+class quadtree:
+    # A quadtree over a landscape's chunks. Leaves hold one chunk; inner
+    # nodes hold up to four children and the bounding box around them.
+
+    def __init__(s, land, chunkQuads=CHUNK_QUADS, levels=LOD_LEVELS):
+        """ Chunk up the landscape land and build the tree. The index
+        buffer for every chunk and level ends up in s.indices. """
+
+        n = land.size
+        verts = land.getVerts()
+        heights = verts[:, 1].reshape(n, n)
+        starts = list(range(0, n - 1, chunkQuads))
+
+        s.chunks = {} # (chunk row, chunk col) -> chunk
+        buffers = []
+        offset = 0
+        for ci, r0 in enumerate(starts):
+            r1 = min(r0 + chunkQuads, n - 1)
+            for cj, c0 in enumerate(starts):
+                c1 = min(c0 + chunkQuads, n - 1)
+
+                lods = []
+                for k in range(levels):
+                    idx = s.gridIndices(n, r0, r1, c0, c1, 2**k)
+                    buffers.append(idx)
+                    lods.append((offset, len(idx)))
+                    offset += idx.nbytes
+
+                block = heights[r0:r1+1, c0:c1+1]
+                lo = verts[r1*n + c0].copy() # bottom left corner
+                hi = verts[r0*n + c1].copy() # top right corner
+                lo[1] = block.min()
+                hi[1] = block.max()
+                s.chunks[(ci, cj)] = chunk(lo, hi, lods)
+
+        s.indices = concatenate(buffers)
+        s.root = s.makeNode(0, 0, len(starts))
+
+    @staticmethod
+    def gridIndices(n, r0, r1, c0, c1, stride):
+        """ Triangle indices covering rows r0..r1 and columns c0..c1 of an
+        n x n vertex grid, using every stride'th row and column (plus the
+        last, so chunk edges line up). """
+
+        rows = arange(r0, r1, stride, dtype=uint32)
+        rows = concatenate((rows, array([r1], dtype=uint32)))
+        cols = arange(c0, c1, stride, dtype=uint32)
+        cols = concatenate((cols, array([c1], dtype=uint32)))
+
+        q1 = (rows[:-1, newaxis] * n + cols[:-1]).ravel()
+        q2 = (rows[:-1, newaxis] * n + cols[1:]).ravel()
+        q3 = (rows[1:, newaxis] * n + cols[:-1]).ravel()
+        q4 = (rows[1:, newaxis] * n + cols[1:]).ravel()
+        return stack((q1, q2, q3, q2, q3, q4), axis=1).ravel()
+
+    def makeNode(s, ci, cj, span):
+        """ Make the node covering span x span chunks, starting at chunk
+        (ci, cj). Returns None if there are no chunks there. """
+
+        if (ci, cj) not in s.chunks:
+            return None
+        if span == 1:
+            c = s.chunks[(ci, cj)]
+            return (c.lo, c.hi, c, [])
+
+        half = (span + 1) // 2
+        children = [s.makeNode(ci + i, cj + j, half)
+                    for i in (0, half) for j in (0, half)]
+        children = [c for c in children if c is not None]
+        lo = [min(c[0][i] for c in children) for i in range(3)]
+        hi = [max(c[1][i] for c in children) for i in range(3)]
+        return (lo, hi, None, children)
+
+    def select(s, view, eye):
+        """ Return the (offset, count) index ranges to draw for frustum
+        view, seen from point eye. Chunks outside the frustum are
+        skipped; the rest get a level of detail by distance. """
+
+        draws = []
+        s.collect(s.root, view, eye, draws, False)
+        return draws
+
+    def collect(s, node, view, eye, draws, inside):
+        """ Append the draws for node to draws. If inside is True the
+        node is known to be in the frustum, so it isn't tested. """
+
+        lo, hi, leaf, children = node
+        if not inside:
+            where = view.classify(lo, hi)
+            if where < 0:
+                return
+            inside = where > 0
+
+        if leaf is not None:
+            draws.append(leaf.lods[leaf.level(eye)])
+            return
+        for child in children:
+            s.collect(child, view, eye, draws, inside)
@@ -12,7 +12,6 @@
 from constants import EPSILON
 from geometry import vector
 from math import sin, cos, sqrt, acos, pi
-from OpenGL.GL import *
 
 #
 # Description of quaternion objects and their methods.
@@ -65,6 +64,7 @@ class quat:
 
     def glRotate(self):
         """ Issues a glRotatef using the rotation of self. """
+        from OpenGL.GL import glRotatef # only needed when drawing
         theta,axis = self.as_rotation()
         glRotatef(theta*180.0/pi,axis[0],axis[1],axis[2])
 
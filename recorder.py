@@ -0,0 +1,145 @@
+# recorder.py
+#
+# A flight data recorder. airplane.fly() hands it the airplane after every
+# step, and it writes one fixed-size binary record - the time, the rigid
+# body's position, orientation, velocity and angular momentum, the control
+# inputs, the AoA and the stall warning - into a file.
+#
+# The file is a ring buffer: it is made full size when the recorder is
+# created, memory-mapped, and once it's full the oldest records are
+# overwritten. Recording a step is a few slice copies into the mapped
+# page, no allocation and no system call; the OS writes the pages out. The
+# layout is:
+#
+#   HEADER_SIZE bytes   magic, capacity, records written so far, fields
+#   capacity records    RECORD (all little endian float64)
+#
+# log() gives the records as a numpy structured array that is a view of
+# the file itself (no copy), so a recording can be read with
+#
+#   >>> from recorder import recorder
+#   >>> log = recorder.open('flight.fdr').log()
+#   >>> log['P'][:, 1] # altitude over time, world units
+#
+# Set constants.RECORDER to a file name to record every flight:
+# pyflight.py gives the airplane it flies a recorder (airplane.recorder).
+# Headless airplanes (engine.py, golden.py, replays) don't record, so they
+# don't overwrite it.
+
+import sys
+from numpy import memmap, ndarray, dtype, float64, int64, concatenate
+
+from constants import RECORDER_CAPACITY
+
+MAGIC = b'PYFDREC1'
+HEADER_SIZE = 64 # bytes, the records start here
+
+RECORD = dtype([('time', '<f8'), # sim seconds
+                ('P', '<f8', 3), # position, world units
+                ('Q', '<f8', 4), # orientation quaternion (w, x, y, z)
+                ('V', '<f8', 3), # velocity, world units per second
+                ('AM', '<f8', 3), # angular momentum
+                ('controls', '<f8', 3), # stick x, stick y, rudder
+                ('AoA', '<f8'), # degrees
+                ('warning', '<f8')]) # 1 when the stall warning is on
+FIELDS = RECORD.itemsize // 8 # float64s per record
+
+HEADER = dtype([('magic', 'S8'), ('capacity', '<i8'), ('count', '<i8'),
+                ('fields', '<i8')])
+
+
+class recorder:
+    # A ring buffer of flight records, in a memory-mapped file.
+
+    def __init__(s, path, capacity=None, mode='w+'):
+        """ Record to file path, with room for capacity records
+        (RECORDER_CAPACITY by default). Mode 'w+' makes a new, empty
+        file; 'r' and 'r+' open an existing one (capacity is then read
+        from it). """
+
+        s.path = path
+        if mode == 'w+':
+            capacity = capacity or RECORDER_CAPACITY
+            s.file = memmap(path, dtype='u1', mode=mode,
+                            shape=HEADER_SIZE + capacity * RECORD.itemsize)
+        else:
+            s.file = memmap(path, dtype='u1', mode=mode)
+        s.header = s.file[:HEADER_SIZE].view(HEADER)
+        if mode == 'w+':
+            s.header['magic'] = MAGIC
+            s.header['capacity'] = capacity
+            s.header['fields'] = FIELDS
+        elif s.header['magic'][0] != MAGIC or \
+             s.header['fields'][0] != FIELDS:
+            raise ValueError(path + " is not a flight data file")
+
+        s.capacity = int(s.header['capacity'][0])
+        s.count = int(s.header['count'][0]) # records written, ever
+        s.records = s.file[HEADER_SIZE:].view(RECORD) # in file order
+
+        # record() writes through plain ndarray views: indexing a memmap
+        # makes more memmaps, which costs more than the copying
+        data = s.file.view(ndarray)
+        s.rows = data[HEADER_SIZE:].view(float64).reshape(s.capacity, FIELDS)
+        s.written = data[:HEADER_SIZE].view(int64)[2:3] # header count
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """ Open an existing recording, read only by default """
+        return cls(path, mode=mode)
+
+    def record(s, plane):
+        """ Append the state of airplane plane (see airplane.fly) """
+
+        row = s.rows[s.count % s.capacity]
+        rigid = plane.rigid
+        state = rigid.state
+        row[0] = plane.time
+        row[1:8] = state[0:7] # position and orientation
+        row[8:11] = rigid.vel
+        row[11:14] = state[10:13] # angular momentum
+        row[14:19] = (plane.x, plane.y, plane.r, plane.AngleOfAttack,
+                      1.0 if plane.warning else 0.0)
+        s.count += 1
+        s.written[0] = s.count
+
+    def __len__(s):
+        """ How many records the file holds now """
+        return s.count if s.count < s.capacity else s.capacity
+
+    def log(s):
+        """ The records, oldest first, as a structured array view of the
+        file. Once the ring has wrapped around, the oldest records are in
+        the middle of the file, and this has to be a copy; use s.records
+        (the file in order, start at s.count % s.capacity) to avoid
+        that. """
+
+        if s.count <= s.capacity:
+            return s.records[:s.count]
+        k = s.count % s.capacity
+        return concatenate((s.records[k:], s.records[:k]))
+
+    def flush(s):
+        """ Write the records out to the file now """
+        s.file.flush()
+
+    def close(s):
+        """ Flush, and let go of the file """
+        s.flush()
+        del s.file, s.header, s.records, s.rows, s.written
+
+
+def main(argv):
+    """ Print a summary of the recording argv[1] """
+    log = recorder.open(argv[1]).log()
+    if len(log) == 0:
+        print("No records")
+        return
+    print("%d records, %.1f to %.1f s" % (len(log), log['time'][0],
+                                          log['time'][-1]))
+    print("Altitude %.0f to %.0f world units, %d steps with the stall "
+          "warning on" % (log['P'][:, 1].min(), log['P'][:, 1].max(),
+                          int(log['warning'].sum())))
+
+
+if __name__ == '__main__': main(sys.argv)
@@ -0,0 +1,192 @@
+# replay.py
+#
+# Deterministic replay. While recording, every physics step logs the
+# control inputs the airplane flew it with (stick x, stick y, rudder), and
+# every KEYFRAME_INTERVAL steps the airplane's whole state (see
+# airplane.snapshot) is saved as a keyframe. The flight model has no
+# randomness and restoring a snapshot is exact, so flying the logged
+# inputs again from any keyframe repeats the flight bit for bit.
+#
+# Seeking to a step restores the last keyframe before it and flies the
+# steps in between headlessly, so it costs at most KEYFRAME_INTERVAL steps
+# however long the flight is.
+#
+# A recording also keeps the physics settings it was flown with: the step
+# size and the airplane's settings (see airplane.settings). Playing back
+# always steps by the recorded dt and switches the airplane to the
+# recorded integrator; a different wing model or airfoil can't be
+# switched, so seeking with one raises ValueError.
+#
+# Recordings are saved as .npz files. pyflight.py records with
+#
+# > python3 pyflight.py record flight.npz
+#
+# and plays back (with [ and ] to seek 10 s back and forward) with
+#
+# > python3 pyflight.py replay flight.npz
+#
+# Running this module replays a recording headlessly and checks that
+# seeking lands on the same state as flying from the start.
+
+import sys
+import json
+from bisect import bisect_right
+from time import perf_counter
+from numpy import zeros, array, savez, load, float64, array_equal
+
+from constants import TIMESTEP, KEYFRAME_INTERVAL
+from rigidbody import INTEGRATORS
+from units import WU2ft
+
+
+class replay:
+    # The inputs and keyframes of one flight.
+
+    def __init__(s, dt=TIMESTEP, every=KEYFRAME_INTERVAL):
+        """ Make an empty recording of steps of dt seconds, keyframed
+        every every steps """
+        s.dt = dt
+        s.every = every
+        s.controls = zeros((1024, 3)) # inputs of each step, grows
+        s.steps = 0 # steps recorded
+        s.index = [] # the step each keyframe was taken before...
+        s.keyframes = [] # ...and the snapshot
+        s.position = 0 # the next step to play back
+        s.settings = None # the airplane's settings, see airplane.settings
+
+    def record(s, plane):
+        """ Log the step airplane plane is about to fly. Call it before
+        every plane.fly(s.dt). """
+
+        if s.steps == 0:
+            s.settings = plane.settings()
+        if s.steps % s.every == 0:
+            s.index.append(s.steps)
+            s.keyframes.append(plane.snapshot())
+        if s.steps == len(s.controls):
+            bigger = zeros((2 * len(s.controls), 3))
+            bigger[:s.steps] = s.controls
+            s.controls = bigger
+        s.controls[s.steps] = (plane.x, plane.y, plane.r)
+        s.steps += 1
+
+    def save(s, path):
+        """ Write the recording to .npz file path """
+        savez(path, dt=s.dt, every=s.every, controls=s.controls[:s.steps],
+              index=array(s.index, dtype=int),
+              keyframes=array(s.keyframes, dtype=float64),
+              settings=json.dumps(s.settings))
+
+    @classmethod
+    def open(cls, path):
+        """ Read a recording saved by save """
+        data = load(path)
+        r = cls(float(data['dt']), int(data['every']))
+        r.controls = data['controls']
+        r.steps = len(r.controls)
+        r.index = data['index'].tolist()
+        r.keyframes = list(data['keyframes'])
+        r.settings = json.loads(str(data['settings'])) \
+                     if 'settings' in data else None
+        if r.steps and r.index[:1] != [0]:
+            raise ValueError("%s has no keyframe at the start" % path)
+        return r
+
+    def setUp(s, plane):
+        """ Give airplane plane the recorded settings, so it flies the
+        recording the way it was flown. Raises ValueError if that can't
+        be done. """
+
+        if s.settings is None:
+            return # nothing recorded yet
+        now = plane.settings()
+        recorded = s.settings['integrator']
+        if recorded not in INTEGRATORS:
+            raise ValueError("the recording was flown with an integrator "
+                             "that isn't in rigidbody.INTEGRATORS")
+        if now['integrator'] != recorded:
+            plane.rigid.setIntegrator(recorded)
+        for name in ('wing model', 'wing panels', 'airfoil'):
+            if now[name] != s.settings[name]:
+                raise ValueError("the recording was flown with %s %r, "
+                                 "this airplane has %r (see constants.py)"
+                                 % (name, s.settings[name], now[name]))
+
+    def step(s, plane):
+        """ Fly airplane plane through the next recorded step. Returns
+        False (and doesn't fly) once the recording is over. """
+
+        if s.position >= s.steps:
+            return False
+        x, y, rudder = s.controls[s.position].tolist()
+        plane.inputStick(x, y)
+        plane.inputRudder(rudder)
+        plane.fly(s.dt)
+        s.position += 1
+        return True
+
+    def seek(s, plane, n):
+        """ Put airplane plane where it was before step n (clamped to the
+        recording): restore the keyframe at or before n, then fly on to
+        n. Raises ValueError if plane's settings don't match the
+        recording's (see setUp). """
+
+        s.setUp(plane)
+        if not s.keyframes:
+            s.position = 0 # nothing recorded, nowhere to go
+            return
+        n = 0 if n < 0 else s.steps if n > s.steps else n
+        k = bisect_right(s.index, n) - 1
+        plane.restore(s.keyframes[k])
+        s.position = s.index[k]
+        while s.position < n:
+            s.step(plane)
+
+    def seekTime(s, plane, t):
+        """ seek to sim time t, in seconds from the start """
+        s.seek(plane, int(round(t / s.dt)))
+
+    def time(s):
+        """ The sim time of the next step to play back """
+        return s.position * s.dt
+
+
+def main(argv):
+    """ Replay recording argv[1] from the start, checking it passes
+    through every keyframe, then seek back to argv[2] seconds (the middle
+    by default) and check it matches """
+
+    from airplane import airplane
+
+    r = replay.open(argv[1])
+    plane = airplane()
+    start = perf_counter()
+    r.seek(plane, 0)
+    states = {}
+    t = float(argv[2]) if len(argv) > 2 else r.steps * r.dt / 2
+    middle = int(round(t / r.dt))
+    keyframes = dict(zip(r.index, r.keyframes))
+    differ = 0 # keyframes the replay doesn't match
+    while True:
+        if r.position == middle:
+            states[middle] = plane.snapshot()
+        if r.position in keyframes and \
+           not array_equal(plane.snapshot(), keyframes[r.position]):
+            differ += 1
+        if not r.step(plane):
+            break
+    wall = perf_counter() - start
+    print("Replayed %d steps (%.1f s) in %.2f s, final altitude %.0f ft, "
+          "%d of %d keyframes different"
+          % (r.steps, r.steps * r.dt, wall, WU2ft(plane.altitude), differ,
+             len(keyframes)))
+
+    start = perf_counter()
+    r.seek(plane, middle)
+    wall = perf_counter() - start
+    same = middle in states and array_equal(plane.snapshot(), states[middle])
+    print("Seek to %.1f s took %.1f ms, state %s" % (middle * r.dt, wall * 1e3,
+          "identical" if same else "DIFFERENT"))
+
+
+if __name__ == '__main__': main(sys.argv)
@@ -10,300 +10,540 @@
 # Glenn Fielder - Rotation and Inertial Tensors
 # http://gafferongames.com/virtual-go/rotation-and-inertia-tensors/
 # (AWESOME article!)
+#
+# The state of the body lives in one preallocated float64 array,
+# s.state: position (3), orientation as a unit quaternion w, x, y, z (4),
+# linear momentum (3) and angular momentum (3). Everything derived from it
+# (velocity, rotation matrix, world space inverse inertia, ...) also has a
+# preallocated buffer, so a step doesn't create any new arrays. The
+# geometry.py objects the rest of pyflight reads (s.P, s.V, s.n, s.lift,
+# ...) are updated in place after every step.
+#
+# How the state is advanced each step is up to the body's integrator, one
+# of the update* methods below (see INTEGRATORS and constants.INTEGRATOR).
+# benchmark.py compares what they cost against how accurate they are.
 
 from geometry import *
 from quat import *
-from airplane import *
+from units import *
 from constants import *
 
 from numpy import *
 from math import sin, cos, sqrt
 from quat import *
 
+STATE_SIZE = 13 # position, orientation quaternion, linear and angular
+# momentum
+SNAPSHOT_SIZE = 49 # see rigidBody.snapshot
+
+# Named points forces can act at, in body coordinates (x = right wing,
+# y = up, z = nose). Any other body coordinates work too, see addForce.
+POINTS = {'left': (-1.0, 0.0, 0.0), 'l': (-1.0, 0.0, 0.0),
+          'right': (1.0, 0.0, 0.0), 'r': (1.0, 0.0, 0.0),
+          'nose': (0.0, 0.0, 1.0), 'n': (0.0, 0.0, 1.0),
+          'tail': (0.0, 0.0, -1.0), 't': (0.0, 0.0, -1.0),
+          'up': (0.0, 1.0, 0.0)}
+
 class rigidBody:
 
     # A rigid body (specifically, the pyflight airplane!)
-    instances = []
 
     def __init__(s, x, M, v):
         """ Initialize the plane, at point x, and with mass M, velocity
         vector v """
 
-        s.P = x # The center position
-        s.left = vector(-1.0, 0.0, 0.0) # the left wing
-        s.right = vector(1.0, 0.0, 0.0) # the right wing
-        s.tail = vector(0.0, 0.0, -1.0) # the tail
-        s.nose = vector(0.0, 0.0, 1.0) # the nose
-        s.up = vector(0.0, 1.0, 0.0) # up vector
-
-        # The vectors below are the ROTATED vectors
-        # (call rotateVectors() to update them)
-        s.l = vector(-1.0, 0.0, 0.25) # the left wing
-        s.r = vector(1.0, 0.0, 0.25) # the right wing
-        s.t = vector(0.0, 0.0, -1.0) # the tail
-        s.n = vector(0.0, 0.0, 1.0) # the nose
-        s.lift = vector(0.0, 1.0, 0.0) # The lift vector
-
-        s.acc = vector(0.0, 0.0, 0.0)
-        s.omega = matrix([0, 0, 0]) # represents rotational velocity
-        
-
-
         s.M = M # total mass of the plane
 
-        s.PForces = [] # Forces acting on plane overall -
-        # these will move the plane around linearly
-
-        # Each part of the plane has its own list of forces.
-        # These will constribute to the plane's rotation.
-        # Gravity acts on everything, so it's allllways there
-        s.lForces = [] # left wing forces
-        s.rForces = [] # right wing forces
-        s.nForces = [] # nose forces
-        s.tForces = [] # forces on the tail
-
-        
-        s.pointForces = {} # Point force dictionary -
-        # allows you to get forces lists by name
-        s.pointForces['left'] = s.lForces
-        s.pointForces['right'] = s.rForces
-        s.pointForces['nose'] = s.nForces
-        s.pointForces['tail'] = s.tForces
-        s.pointForces['l'] = s.lForces
-        s.pointForces['r'] = s.rForces
-        s.pointForces['n'] = s.nForces
-        s.pointForces['t'] = s.tForces
-
-        s.I = matrix([[0.177721, 0.0, 0.0],
-                      [0.0, 0.304776, 0.0],
-                      [0.0, 0.0, 0.177721]]) * 100
-        
-        # This is the inertial tensor.
+        # The state, and views of each part of it
+        s.state = zeros(STATE_SIZE)
+        s.pos = s.state[0:3] # center position
+        s.rot = s.state[3:7] # orientation quaternion (w, x, y, z)
+        s.lmom = s.state[7:10] # linear momentum
+        s.amom = s.state[10:13] # angular momentum
+
+        s.version = 0 # bumped whenever the state changes, so anything
+        # computed from the state (see airplane.aero) knows to redo it
+        s.pos[:] = x.components()
+        s.rot[0] = 1.0 # The airplane starts out straight+level
+        s.lmom[:] = v.components()
+        s.lmom *= M
+
+        # This is the inertial tensor, in body coordinates.
         # It represents the plane's distribution of mass.
         # Currently, it assumes the plane is a uniform disk shape; obviously
         # this could be improved!
-        s.Iinv = linalg.inv(s.I)
-        
-        # The state of the airplane:
-
-        # Rotation matrix
-        s.q = quat(0.0, vector(1.0, 0.0, 0.0)) # Rotation quaternion
-        s.R = matrix([[1.0, 0.0, 0.0],
-                      [0.0, 1.0, 0.0],
-                      [0.0, 0.0, 1.0]]) # The airplane starts out straight+level
-        s.RDot = matrix([[0.0, 0.0, 0.0],
-                         [0.0, 0.0, 0.0],
-                         [0.0, 0.0, 0.0]]) # Rate of change of rot. matrix
-
-        s.V = v # starting velocity vector
-        s.AV = vector(0.0, 0.0, 0.0) # starting angular velocity
-        s.LM = v.scale(s.M) # the linear momentum
+        s.Ibody = array([[0.177721, 0.0, 0.0],
+                         [0.0, 0.304776, 0.0],
+                         [0.0, 0.0, 0.177721]]) * 100
+        s.Ibodyinv = linalg.inv(s.Ibody) # Only ever needs inverting once
+
+        # Buffers for values derived from the state
+        s.R = identity(3) # rotation matrix, columns are the body axes
+        s.Iinv = s.Ibodyinv.copy() # world space inverse inertia
+        s.vel = zeros(3) # velocity
+        s.omega = zeros(3) # angular velocity
+        s.qdot = zeros(4) # rate of change of the orientation quaternion
+        s.force = zeros(3) # total force, from computeForces
+        s.torque = zeros(3) # total torque, from computeForces
+        s.scratch = zeros(3)
+        s.scratch4 = zeros(4)
+        s.scratch33 = zeros((3, 3))
+
+        # Scratch buffers for the integrators
+        s.y0 = zeros(STATE_SIZE) # the state at the start of the step
+        s.k = zeros((4, STATE_SIZE)) # derivatives of the state (RK4 stages)
+        s.dy = zeros(STATE_SIZE)
+        s.scale = zeros(STATE_SIZE)
+        s.forceVersion = -1 # state version s.force was computed at (Verlet)
+        s.h = TIMESTEP # the next step size to try (advance)
+        s.evaluations = 0 # how many times the forces have been computed
+
+        # The geometry.py view of the state. These objects are updated in
+        # place (see syncVectors), so it's safe to hold on to them.
+        s.P = point(0.0, 0.0, 0.0) # The center position
+        s.V = vector(0.0, 0.0, 0.0) # velocity
+        s.LM = vector(0.0, 0.0, 0.0) # the linear momentum
         s.AM = vector(0.0, 0.0, 0.0) # the angular momentum
+        s.AV = vector(0.0, 0.0, 0.0) # angular velocity
 
-        rigidBody.instances.append(s)
-
-        
-
-    @classmethod
-    def updateAll(cls):
-        """ Update the positions, velocities, etc for each part """
-        
-        for c in cls.instances:
-            c.updatePositionsEuler()
-            #c.updatePosition()
-            
-    def computeForce(s):
-        """ Get the total force acting on the body """ 
-
-        fv = vector(0.0, 0.0, 0.0) # Overall force vector
-        
-        for f in s.PForces:
-            # Determine if the force is a vector or a function,
-            # and act appropriately:
-            if hasattr(f, '__call__') == True:
-                fv = fv + f(s)
-            else:
-                fv = fv + f
-
-        # Forces on ALL parts of the object contribute to overall force vector
-        for f in s.lForces:
-            if hasattr(f, '__call__') == True:
-                fv = fv + f(s)
-            else:
-                fv = fv + f 
+        # The body axes, rotated to the current orientation
+        s.l = vector(-1.0, 0.0, 0.0) # the left wing
+        s.r = vector(1.0, 0.0, 0.0) # the right wing
+        s.t = vector(0.0, 0.0, -1.0) # the tail
+        s.n = vector(0.0, 0.0, 1.0) # the nose
+        s.lift = vector(0.0, 1.0, 0.0) # The lift vector
 
-        for f in s.rForces:
-            if hasattr(f, '__call__') == True:
-                fv = fv + f(s)
-            else:
-                fv = fv + f
+        # Point forces act at these (the same objects as above)
+        s.left = s.l
+        s.right = s.r
+        s.tail = s.t
+        s.nose = s.n
+        s.up = s.lift
 
-        for f in s.nForces:
-            if hasattr(f, '__call__') == True:
-                fv = fv + f(s)
-            else:
-                fv = fv + f
+        # The force registry: one (function, point) pair per force, in
+        # the order they were added. function(body) returns the force
+        # vector; point is where it acts, in body coordinates, or None
+        # for forces through the center of mass (which don't rotate the
+        # body). See addForce.
+        s.forces = []
+        s.wrenches = [] # functions returning a force and a torque, see
+        # addWrench
 
-        for f in s.tForces:
-            if hasattr(f, '__call__') == True:
-                fv = fv + f(s)
-            else:
-                fv = fv + f
+        s.rotateVectors()
+        s.updateDerivatives()
+        s.syncVectors()
+
+        s.setIntegrator(INTEGRATOR)
+
+    def setIntegrator(s, integrator):
+        """ Pick how the body is advanced each step: a name from
+        INTEGRATORS, or any function(body, dt) """
+
+        if isinstance(integrator, str):
+            integrator = INTEGRATORS[integrator]
+        s.integrator = integrator
+        s.integratorName = None # its name, if it's one of INTEGRATORS
+        for name, function in INTEGRATORS.items():
+            if function is integrator:
+                s.integratorName = name
+                break
+
+    def step(s, dt=TIMESTEP):
+        """ Advance the body dt seconds with its integrator """
+        s.integrator(s, dt)
+
+    def computeForces(s):
+        """ Get the total force and torque acting on the body, into
+        s.force and s.torque. Every force is evaluated once; the ones
+        acting at a point contribute r x F to the torque as well, and
+        wrenches add their own torque. """
+
+        s.evaluations += 1
+        fx = fy = fz = 0.0 # Overall force vector
+        tx = ty = tz = 0.0 # and torque
+        (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = s.R.tolist()
+
+        for function, p in s.forces:
+            f = function(s)
+            fdx, fdy, fdz = f.dx, f.dy, f.dz
+            fx += fdx
+            fy += fdy
+            fz += fdz
+            if p is not None:
+                # The lever arm, rotated into world coordinates
+                bx, by, bz = p
+                px = r00*bx + r01*by + r02*bz
+                py = r10*bx + r11*by + r12*bz
+                pz = r20*bx + r21*by + r22*bz
+                tx += py*fdz - pz*fdy
+                ty += pz*fdx - px*fdz
+                tz += px*fdy - py*fdx
+
+        for function in s.wrenches:
+            f, t = function(s)
+            fx += f.dx
+            fy += f.dy
+            fz += f.dz
+            tx += t.dx
+            ty += t.dy
+            tz += t.dz
+
+        s.force[0] = fx
+        s.force[1] = fy
+        s.force[2] = fz
 
-        
-        return fv.scale(TIMESTEP)
+        # Add a rotational damping factor:
+        am = s.amom.tolist()
+        s.torque[0] = tx - 0.1*am[0]
+        s.torque[1] = ty - 0.1*am[1]
+        s.torque[2] = tz - 0.1*am[2]
+        return s.force, s.torque
 
-    def computeTorque(s):
-        """ get the total torque vector on the object. """
 
-        tv = vector(0.0, 0.0, 0.0)
+    def updateMomentum(s, dt=TIMESTEP):
+        """ Update momentum based on current forces """
 
-        # Get the torques for eachpart:
-        xt = vector(s.P.x, s.P.y, s.P.z) # This vector represents the current displace
-        #ment
-        
-        for f in s.lForces:
-            if hasattr(f, '__call__') == True:
-                tv = tv + ((s.left).cross(f(s))) 
-            else:
-                tv = tv + ((s.left).cross(f))
+        s.computeForces()
+        multiply(s.force, dt, out=s.scratch)
+        add(s.lmom, s.scratch, out=s.lmom)
+        multiply(s.torque, dt, out=s.scratch)
+        add(s.amom, s.scratch, out=s.amom)
 
-        for f in s.rForces:
-            if hasattr(f, '__call__') == True:
-                tv = tv + ((s.right).cross(f(s))) 
-            else:
-                tv = tv + ((s.right).cross(f))
 
-        for f in s.nForces:
-            if hasattr(f, '__call__') == True:
-                tv = tv + ((s.nose).cross(f(s))) 
-            else:
-                tv = tv + ((s.nose).cross(f))
+    def updateDerivatives(s):
+        """ Compute velocity, angular velocity, and the rate of change of
+        the orientation quaternion from the current state """
 
-        for f in s.tForces:
-            if hasattr(f, '__call__') == True:
-                tv = tv + ((s.tail).cross(f(s))) 
-            else:
-                tv = tv + ((s.tail).cross(f)) 
-        
-        # Add a rotational damping factor:
-        tv += s.AM.scale(-0.1)
-        return tv.scale(TIMESTEP)
-            
+        multiply(s.lmom, 1/s.M, out=s.vel)
+        dot(s.Iinv, s.amom, out=s.omega)
 
-    def updateMomentum(s):
-        """ Update momentum based on current forces """
-        
-        s.LM += s.computeForce()
-        s.AM += s.computeTorque()
+        # dq/dt = 1/2 (0, omega) q
+        wx, wy, wz = s.omega.tolist()
+        qw, qx, qy, qz = s.rot.tolist()
+        s.qdot[0] = -0.5 * (wx*qx + wy*qy + wz*qz)
+        s.qdot[1] = 0.5 * (wx*qw + wy*qz - wz*qy)
+        s.qdot[2] = 0.5 * (wy*qw + wz*qx - wx*qz)
+        s.qdot[3] = 0.5 * (wz*qw + wx*qy - wy*qx)
 
 
-    def updateVelocity(s):
+    def updateVelocity(s, dt=TIMESTEP):
         """ Use the current momentum to compute velocity """
-        s.updateMomentum()
-        s.V = s.LM.scale(1/s.M)
+        s.updateMomentum(dt)
+        s.updateDerivatives()
 
-        s.omega = s.Iinv * s.AM.np_vector()
-        s.RDot = star(s.omega) * s.R # Rate of change of rotation
-#        s.q = s.q*quat(0.0, npArray2Vector(s.omega)).scale(1/2)
-#        s.q.glRotate()
 
-    def updateI(s):
-        """ Update the inerial tensor to reflect the current orientation """
+    def derivative(s, out):
+        """ The rate of change of the whole state - velocity, dq/dt,
+        force and torque - into out. The derived values (s.vel, s.qdot,
+        the axes, ...) must match the state. """
 
-        s.I = s.R * s.I * transpose(s.R)
-        s.Iinv = linalg.inv(s.I)
-                                
+        s.computeForces()
+        out[0:3] = s.vel
+        out[3:7] = s.qdot
+        out[7:10] = s.force
+        out[10:13] = s.torque
 
-    
-    def updatePosition(s):
-        """ Compute the updated position of the plane, based on velocity
-        this frame. Uses RK4 """
-
-
-        yn = s.P # Starting position
-        ynR = s.R # starting rotation
-        
-        s.updateVelocity() # updates linear and angular velocity
-        k1 = s.V.scale(TIMESTEP)
-        k1R = s.RDot * TIMESTEP
-        
-        s.P = yn + k1.scale(1/2)
-        s.R = ynR + k1R * (1/2)
-        s.rotateVectors()
-        s.updateVelocity()
-        k2 = s.V.scale(TIMESTEP)
-        k2R = s.RDot * TIMESTEP
 
-        s.P = yn + k2.scale(1/2)
-        s.R = ynR + k2R * (1/2)
-        s.rotateVectors()
-        s.updateVelocity()
-        k3 = s.V.scale(TIMESTEP)
-        k3R = s.RDot * TIMESTEP
+    def stateChanged(s):
+        """ Bring everything derived from the state up to date, after
+        changing s.state directly """
 
-        s.P = yn + k3
-        s.R = ynR + k3R
-        s.rotateVectors()
-        s.updateVelocity()
-        k4 = s.V.scale(TIMESTEP)
-        k4R = s.RDot * TIMESTEP
-
-        s.P = yn + k1.scale(1/6) + k2.scale(1/3) \
-                + k3.scale(1/3) + k4.scale(1/6)
-        
-        s.R = ynR + k1R*(1/6) + k2R*(1/3) + k3R*(1/3) + k4R*(1/6)
         s.rotateVectors()
+        s.updateDerivatives()
+        s.syncVectors()
+
+    def snapshot(s):
+        """ Everything a step depends on - the state, the values derived
+        from it, the last forces and the next adaptive step size - as one
+        array of SNAPSHOT_SIZE, for restore """
+
+        return concatenate((s.state, s.R.ravel(), s.Iinv.ravel(), s.vel,
+                            s.omega, s.qdot, s.force, s.torque,
+                            [s.h, 1.0 if s.forceVersion == s.version
+                             else 0.0]))
+
+    def restore(s, a):
+        """ Go back to snapshot a. The derived values are copied rather
+        than recomputed (stateChanged renormalizes the quaternion), so
+        the body steps on bit for bit as it did after the snapshot. """
+
+        s.state[:] = a[0:13]
+        s.R[:] = a[13:22].reshape(3, 3)
+        s.Iinv[:] = a[22:31].reshape(3, 3)
+        s.vel[:] = a[31:34]
+        s.omega[:] = a[34:37]
+        s.qdot[:] = a[37:41]
+        s.force[:] = a[41:44]
+        s.torque[:] = a[44:47]
+        s.h = float(a[47])
+
+        rx, ux, nx, ry, uy, ny, rz, uz, nz = s.R.ravel().tolist()
+        s.r.set(rx, ry, rz)
+        s.l.set(-rx, -ry, -rz)
+        s.lift.set(ux, uy, uz)
+        s.n.set(nx, ny, nz)
+        s.t.set(-nx, -ny, -nz)
+        s.syncVectors()
+        s.forceVersion = s.version if a[48] else -1
 
 
-    def resetR(s):
-        """ Resets the rotation matrix, so that the object's
-        current orientation is now the "default" orientation. """
-        
-        s.R = matrix([[1, 0, 0],
-                      [0, 1, 0],
-                      [0, 0, 1]])
+    def updateI(s):
+        """ Update the world space inverse inertia tensor to reflect the
+        current orientation: R Ibody^-1 R^T """
 
-        s.left = s.l
-        s.right = s.r
-        s.nose = s.n
-        s.tail = s.t
-        s.up = s.lift
+        dot(s.R, s.Ibodyinv, out=s.scratch33)
+        dot(s.scratch33, s.R.T, out=s.Iinv)
 
-    def addForce(s, f):
-        """ Adds a force to this object's force list. Forces are either
-        functions returning vectors or just vectors. """
 
-        s.PForces.append(f)
+
+    def updatePosition(s, dt=TIMESTEP):
+        """ Compute the updated position of the plane, based on velocity
+        this frame. Uses RK4 on the whole state, so the forces are
+        evaluated four times per step. """
+
+        y0 = s.y0
+        y0[:] = s.state # Starting position, rotation and momentum
+        k = s.k
+
+        s.updateDerivatives()
+        for i, h in enumerate((0.5, 0.5, 1.0, None)):
+            s.derivative(k[i])
+            if h is not None:
+                # The state for the next stage: y0 + h dt k[i]
+                multiply(k[i], h*dt, out=s.state)
+                add(s.state, y0, out=s.state)
+                s.stateChanged()
+
+        # y0 + dt/6 (k1 + 2 k2 + 2 k3 + k4)
+        dot(RK4_WEIGHTS, k, out=s.dy)
+        multiply(s.dy, dt, out=s.dy)
+        add(y0, s.dy, out=s.state)
+        s.stateChanged()
+
+
+    def addForce(s, f, p=None):
+        """ Adds a force to this object's force list. Forces are either
+        functions returning vectors or just vectors. 'p' is the point the
+        force acts at, in body coordinates: a name from POINTS ('nose',
+        'tail', ...), an (x, y, z) sequence or a vector. Without a point
+        the force acts through the center of mass. """
+
+        if not callable(f):
+            v = f # a constant force
+            f = lambda obj: v
+        if p is not None:
+            if isinstance(p, str):
+                p = POINTS[p]
+            elif isinstance(p, vector):
+                p = p.components()
+            p = tuple(float(c) for c in p)
+        s.forces.append((f, p))
+
+    def addWrench(s, f):
+        """ Adds a function returning a force vector and the torque
+        vector it exerts about the center of mass - for things that work
+        out their own torque, like a wing split into panels. """
+
+        s.wrenches.append(f)
 
     def addPointForce(s, f, p):
         """ Adds a force to this object, acting at a particular point.
-        'p' argument speficies which point, i.e., nose, tail, etc. """
+        'p' argument speficies which point, i.e., nose, tail, etc., or
+        any body coordinates (see addForce). """
 
-        s.pointForces[p].append(f)
+        s.addForce(f, p)
 
     def rotateVectors(s):
-        """ Rotate all the vectors to reflect the current orientation.
-        Also updates the inertial tensor. """
-        s.l = npArray2Vector(s.R*s.left.np_vector()).unit()
-        s.r = npArray2Vector(s.R*s.right.np_vector()).unit()
-        s.t = npArray2Vector(s.R*s.tail.np_vector()).unit()
-        s.n = npArray2Vector(s.R*s.nose.np_vector()).unit()
-        s.lift = npArray2Vector(s.R*s.up.np_vector()).unit()
+        """ Normalize the orientation quaternion, rebuild the rotation
+        matrix from it, and rotate all the vectors to reflect the current
+        orientation. Also updates the inertial tensor. """
+
+        w, x, y, z = s.rot.tolist()
+        norm = sqrt(w*w + x*x + y*y + z*z)
+        w, x, y, z = w/norm, x/norm, y/norm, z/norm
+        q = s.rot
+        q[0] = w
+        q[1] = x
+        q[2] = y
+        q[3] = z
+
+        # The body axes are the columns of R
+        rx, ry, rz = 1 - 2*(y*y + z*z), 2*(x*y + w*z), 2*(x*z - w*y)
+        ux, uy, uz = 2*(x*y - w*z), 1 - 2*(x*x + z*z), 2*(y*z + w*x)
+        nx, ny, nz = 2*(x*z + w*y), 2*(y*z - w*x), 1 - 2*(x*x + y*y)
+        R = s.R
+        R[0, 0] = rx
+        R[1, 0] = ry
+        R[2, 0] = rz
+        R[0, 1] = ux
+        R[1, 1] = uy
+        R[2, 1] = uz
+        R[0, 2] = nx
+        R[1, 2] = ny
+        R[2, 2] = nz
+
+        s.r.set(rx, ry, rz)
+        s.l.set(-rx, -ry, -rz)
+        s.lift.set(ux, uy, uz)
+        s.n.set(nx, ny, nz)
+        s.t.set(-nx, -ny, -nz)
         s.updateI()
-        s.resetR()
+        s.version += 1
+
+    def syncVectors(s):
+        """ Copy the state into the geometry.py objects (s.P, s.V, ...)
+        the rest of pyflight reads """
+
+        s.P.set(*s.pos.tolist())
+        s.V.set(*s.vel.tolist())
+        s.LM.set(*s.lmom.tolist())
+        s.AM.set(*s.amom.tolist())
+        s.AV.set(*s.omega.tolist())
+        s.version += 1
+
 
-        
     def liftTest(s, obj):
         return s.lift
-        
-    def updatePositionsEuler(s):
-        """ Updates positions and rotation, using crappy euler integration
-        """
 
-        s.updateVelocity()
-        s.rotateVectors()
+    def updatePositionsEuler(s, dt=TIMESTEP):
+        """ Updates positions and rotation, using crappy euler integration
+        - semi implicit: the momentum is updated first, and the new
+        velocities move the body. One force evaluation per step. """
 
-        s.P += s.V.scale(TIMESTEP)
-        s.R = s.R + s.RDot*TIMESTEP
+        s.updateVelocity(dt)
 
+        multiply(s.vel, dt, out=s.scratch)
+        add(s.pos, s.scratch, out=s.pos)
+        multiply(s.qdot, dt, out=s.scratch4)
+        add(s.rot, s.scratch4, out=s.rot)
+        s.rotateVectors()
+        s.syncVectors()
+
+    def updatePositionsExplicit(s, dt=TIMESTEP):
+        """ Updates the state with plain (explicit) Euler integration:
+        everything moves by its rate of change at the start of the step.
+        One force evaluation per step. """
+
+        s.updateDerivatives()
+        s.derivative(s.dy)
+        multiply(s.dy, dt, out=s.dy)
+        add(s.state, s.dy, out=s.state)
+        s.stateChanged()
+
+    def updatePositionsVerlet(s, dt=TIMESTEP):
+        """ Updates the state with velocity Verlet (kick, drift, kick):
+        half a step of momentum, a whole step of position and rotation,
+        then the other half step of momentum with the forces there.
+        Those forces are reused for the next step's first kick, so it's
+        one force evaluation per step. Lift, drag and the rotational
+        damping depend on velocity, and are taken at the half step
+        velocity - so for this airplane it's only first order, like
+        Euler. """
+
+        if s.forceVersion != s.version:
+            s.computeForces() # the state changed some other way
+        half = dt / 2
+
+        multiply(s.force, half, out=s.scratch)
+        add(s.lmom, s.scratch, out=s.lmom)
+        multiply(s.torque, half, out=s.scratch)
+        add(s.amom, s.scratch, out=s.amom)
+        s.updateDerivatives()
+
+        multiply(s.vel, dt, out=s.scratch)
+        add(s.pos, s.scratch, out=s.pos)
+        multiply(s.qdot, dt, out=s.scratch4)
+        add(s.rot, s.scratch4, out=s.rot)
+        s.stateChanged()
+
+        s.computeForces()
+        multiply(s.force, half, out=s.scratch)
+        add(s.lmom, s.scratch, out=s.lmom)
+        multiply(s.torque, half, out=s.scratch)
+        add(s.amom, s.scratch, out=s.amom)
+        s.updateDerivatives()
+        s.syncVectors()
+        s.forceVersion = s.version
+
+    def advance(s, T, tol=ADAPTIVE_TOLERANCE):
+        """ Advance the body T seconds with adaptive steps: as long as
+        the estimated error per step allows, at most T. The error of each
+        state value has to stay under tol * (1 + |value|). Uses the
+        Bogacki-Shampine 3(2) pair, three force evaluations per step (the
+        fourth is reused as the first of the next step). Returns the
+        number of steps taken. A step whose error isn't finite is retried
+        shorter; if it still isn't at MIN_STEP, raises FloatingPointError,
+        leaving the body at the start of that step. """
+
+        y0 = s.y0
+        k = s.k
+        scale = s.scale
+        steps = 0
+        t = 0.0
+
+        s.updateDerivatives()
+        s.derivative(k[0])
+        while True:
+            last = s.h >= T - t
+            h = T - t if last else s.h
+            y0[:] = s.state
+
+            # Two more stages, then the third order solution
+            for i, c in ((1, 0.5), (2, 0.75)):
+                multiply(k[i - 1], c*h, out=s.state)
+                add(s.state, y0, out=s.state)
+                s.stateChanged()
+                s.derivative(k[i])
+            dot(BS_WEIGHTS, k[0:3], out=s.dy)
+            multiply(s.dy, h, out=s.dy)
+            add(y0, s.dy, out=s.state)
+            s.stateChanged()
+            s.derivative(k[3])
+
+            # The difference from the embedded second order solution
+            dot(BS_ERROR, k, out=s.dy)
+            multiply(s.dy, h, out=s.dy)
+            maximum(abs(y0), abs(s.state), out=scale)
+            multiply(scale, tol, out=scale)
+            add(scale, tol, out=scale)
+            divide(s.dy, scale, out=s.dy)
+            error = sqrt(float(dot(s.dy, s.dy)) / STATE_SIZE)
+            if not isfinite(error):
+                # A force came out NaN or infinite. A shorter step may
+                # help; once they're down to MIN_STEP, nothing will.
+                s.state[:] = y0
+                s.stateChanged()
+                if h < MIN_STEP:
+                    raise FloatingPointError("advance: the forces aren't "
+                                             "finite at t = %g" % t)
+                s.h = h * 0.2
+                continue
+
+            # The next step size: the error goes as h^3
+            factor = 0.9 * error**(-1/3) if error > 0.0 else 5.0
+            factor = 5.0 if factor > 5.0 else 0.2 if factor < 0.2 else factor
+            if error <= 1.0 or h < MIN_STEP:
+                t += h
+                steps += 1
+                k[0] = k[3]
+                if h == s.h or factor < 1.0:
+                    s.h = h * factor
+                if last:
+                    return steps
+            else:
+                # Too inaccurate, try again from y0 with a smaller step
+                s.state[:] = y0
+                s.stateChanged()
+                s.h = h * factor
+
+RK4_WEIGHTS = array([1/6, 1/3, 1/3, 1/6])
+BS_WEIGHTS = array([2/9, 1/3, 4/9]) # Bogacki-Shampine, third order
+BS_ERROR = array([2/9 - 7/24, 1/3 - 1/4, 4/9 - 1/3, -1/8]) # minus second
+MIN_STEP = 1e-6 # seconds, advance takes steps this short whatever the error
+
+# The integrators, by name. Each advances a body by dt seconds.
+INTEGRATORS = {'euler': rigidBody.updatePositionsExplicit,
+               'semi-implicit': rigidBody.updatePositionsEuler,
+               'rk4': rigidBody.updatePosition,
+               'verlet': rigidBody.updatePositionsVerlet,
+               'adaptive': rigidBody.advance}
@@ -0,0 +1,20 @@
+# test_airfoil.py
+#
+# airfoils/pyflight.csv is the default airfoil printed by airfoil.py; read
+# back, it should give the same tables, stall included.
+#
+# > python3 -m pytest test_airfoil.py
+
+from numpy import abs
+
+import airfoil
+
+
+def test_pyflight_csv_matches_default():
+    default = airfoil.get(None)
+    loaded = airfoil.airfoil.load('pyflight')
+    aoa = default.lift.grid()
+    assert abs(loaded.CoL(aoa) - default.CoL(aoa)).max() <= \
+           airfoil.CSV_TOLERANCE
+    assert abs(loaded.CoD(aoa) - default.CoD(aoa)).max() <= \
+           airfoil.CSV_TOLERANCE
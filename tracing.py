@@ -0,0 +1,120 @@
+# tracing.py
+#
+# An opt-in tracer that records when things happened, for lining frames
+# up over time: GLUT timer jitter, long physics steps, buffer swap stalls.
+# Spans (a name, a start and a duration) and counters go into an in-memory
+# buffer holding the last TRACE_CAPACITY events, and dump() writes them
+# out as Chrome trace event JSON, which https://ui.perfetto.dev (or
+# chrome://tracing) opens.
+#
+# Functions are traced with the decorator:
+#
+#   @traced('airplane.fly', 'physics')
+#   def fly(s, dt=TIMESTEP): ...
+#
+# and stretches of code with begin() / end():
+#
+#   t = tracer.begin()
+#   glutSwapBuffers()
+#   tracer.end('swap', t, 'draw')
+#
+# Tracing is off until tracer.start() is called; then a traced call
+# costs one flag check. pyflight.py starts it with
+#
+# > python3 pyflight.py trace session.json
+#
+# (or by pressing t), and writes the trace when it quits (or t is pressed
+# again).
+
+import os
+import json
+from collections import deque
+from functools import wraps
+from threading import get_ident
+from time import perf_counter
+
+from constants import TRACE_CAPACITY
+
+
+class traceBuffer:
+    # A buffer of trace events.
+
+    def __init__(s, capacity=TRACE_CAPACITY):
+        """ Make a tracer (switched off) keeping the last capacity
+        events """
+        s.enabled = False
+        s.events = deque(maxlen=capacity) # (phase, name, category,
+        # start, duration, args), times in perf_counter seconds
+        s.origin = perf_counter() # time 0 of the trace
+
+    def start(s):
+        """ Start recording events """
+        s.enabled = True
+
+    def stop(s):
+        """ Stop recording; the events so far are kept """
+        s.enabled = False
+
+    def clear(s):
+        """ Throw the events away """
+        s.events.clear()
+        s.origin = perf_counter()
+
+    def begin(s):
+        """ The start time to pass to end(), or None if tracing is off """
+        return perf_counter() if s.enabled else None
+
+    def end(s, name, started, category='', args=None):
+        """ Record a span called name, from started (from begin()) until
+        now. args, a dict, is shown with it. """
+        if started is not None:
+            s.events.append(('X', name, category, started,
+                             perf_counter() - started, args))
+
+    def counter(s, name, value, category=''):
+        """ Record the value of counter name now """
+        if s.enabled:
+            s.events.append(('C', name, category, perf_counter(), 0.0,
+                             {name: value}))
+
+    def dump(s, path):
+        """ Write the events to path as Chrome trace event JSON """
+
+        pid = os.getpid()
+        tid = get_ident()
+        events = [{'ph': 'M', 'name': 'process_name', 'pid': pid,
+                   'tid': tid, 'args': {'name': 'pyflight'}}]
+        for phase, name, category, start, duration, args in s.events:
+            event = {'ph': phase, 'name': name, 'cat': category,
+                     'pid': pid, 'tid': tid,
+                     'ts': (start - s.origin) * 1e6} # microseconds
+            if phase == 'X':
+                event['dur'] = duration * 1e6
+            if args is not None:
+                event['args'] = args
+            events.append(event)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events) - 1
+
+
+tracer = traceBuffer() # the one everything traces to
+
+
+def traced(name, category=''):
+    """ Decorator: record a span called name for every call of the
+    function, while tracing is on """
+
+    def decorate(f):
+        @wraps(f)
+        def call(*args, **kwargs):
+            if not tracer.enabled:
+                return f(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                tracer.events.append(('X', name, category, start,
+                                       perf_counter() - start, None))
+        return call
+    return decorate
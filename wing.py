@@ -0,0 +1,107 @@
+# wing.py
+#
+# A blade element model of the airplane's wings. Instead of one lift force
+# per wing at -/+1 unit along the right wing axis (airplane.leftWing and
+# airplane.rightWing), each wing is split into spanwise panels. Every
+# panel gets its own airflow - the body's velocity plus omega x r, so a
+# rolling or yawing airplane sees more AoA on one side than the other -
+# and its own AoA, coefficient of lift and airspeed multiplier from the
+# airfoil tables. All panels are computed together as numpy arrays, and
+# the total lift and its torque go to the rigidBody as one wrench.
+#
+# Lift still acts along the body's up axis and scales the same way as in
+# aeroState.update, and the stick still scales each wing's lift by
+# (1 +/- x)/2. With the panels evenly spread over a half span of 2, the
+# average lever arm is 1 unit, as in the point model, so the plane flies
+# the same in steady flight; the difference is in the roll and yaw
+# damping the panels add. The lift alone stops damping the roll once the
+# wing is stalled (CoL is flat there), so each panel also feels a
+# flat-plate force against its up/down motion from the rotation
+# (ROLL_DAMPING), and the roll dies away whatever the AoA.
+#
+# Set constants.WING_MODEL to 'panels' to use it.
+
+from numpy import arange, concatenate, zeros, ones, full, dot, sqrt, \
+     arccos, clip, where, pi
+
+from geometry import vector
+from units import WUps2kts
+
+WING_SPAN = 2.0 # length of each wing along the right axis, body units
+LIFT_SCALE = 70 # the same constant as aeroState.update
+ROLL_DAMPING = 1.5 # force on a panel per unit of its up/down speed from the
+# rotation and of its airspeed, per unit of air density and panel share
+
+
+class wing:
+    # Both wings of an airplane, as panels.
+
+    def __init__(s, plane, panels, span=WING_SPAN):
+        """ Make the wings for airplane plane, with panels panels per
+        wing, each wing span units long. """
+
+        s.plane = plane
+        s.panels = panels
+
+        # Panel centers along the right axis: right wing, then left
+        x = (arange(panels) + 0.5) * (span / panels)
+        s.positions = zeros((2 * panels, 3)) # body coordinates
+        s.positions[:, 0] = concatenate((x, -x))
+        s.side = concatenate((ones(panels), full(panels, -1.0)))
+        s.weight = 1.0 / panels # each panel's share of its wing
+
+        s.W = zeros((3, 3)) # scratch, see wrench
+        s.force = vector(0.0, 0.0, 0.0)
+        s.torque = vector(0.0, 0.0, 0.0)
+
+    def wrench(s, obj):
+        """ The total lift of the panels on rigid body obj, and its
+        torque about the center of mass (see rigidBody.addWrench) """
+
+        plane = s.plane
+        aero = plane.aero(obj) # for the air density
+        R = obj.R
+        up = R[:, 1]
+        nose = R[:, 2]
+
+        # Each panel's velocity: v + omega x (R p) for body position p.
+        # omega x (R p) = W R p, W the cross product matrix of omega
+        wx, wy, wz = obj.omega.tolist()
+        s.W[0, 1] = -wz
+        s.W[0, 2] = wy
+        s.W[1, 0] = wz
+        s.W[1, 2] = -wx
+        s.W[2, 0] = -wy
+        s.W[2, 1] = wx
+        v = dot(s.positions, dot(s.W, R).T)
+        spin = dot(v, up) # how fast each panel moves up from the rotation
+        v += obj.vel
+
+        # AoA: the angle between the nose and the airflow, negative when
+        # the airflow comes from above (as in airplane.AoAFor)
+        speed = sqrt((v * v).sum(axis=1))
+        along = dot(v, nose) / where(speed > 0.0, speed, 1.0)
+        aoa = arccos(clip(along, -1.0, 1.0)) * (180 / pi)
+        aoa = where(dot(v, up) > 0.0, -aoa, aoa)
+
+        # Lift on each panel, along the up axis
+        kts = WUps2kts(speed)
+        foil = plane.airfoil
+        stick = (1.0 + s.side * plane.x) / 2
+        lift = foil.multiplier(kts) * foil.CoL(aoa, kts) * stick
+        lift *= LIFT_SCALE * aero.density * s.weight
+
+        # The air also resists each panel moving up or down through it,
+        # stalled or not (like a flat plate). Only the rotation's share
+        # of that counts here - the whole airplane's is already in its
+        # AoA - so it damps the roll without changing steady flight.
+        lift -= ROLL_DAMPING * aero.density * s.weight * speed * spin
+
+        # The torque is the sum of (R p) x (lift up), which is
+        # (R sum(lift p)) x up
+        total = float(lift.sum())
+        ux, uy, uz = up.tolist()
+        ax, ay, az = dot(R, dot(lift, s.positions)).tolist()
+        s.force.set(ux*total, uy*total, uz*total)
+        s.torque.set(ay*uz - az*uy, az*ux - ax*uz, ax*uy - ay*ux)
+        return s.force, s.torque